@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compare the AllRun thread engine with the AsyncRun asyncssh engine against a fake ssh server that answers
+the batched node probe for any number of simulated hosts (127.0.x.y loopback addresses, one port).
+Every probe takes --latency seconds, like the iostat/sar samplers do on a real node.
+
+usage: python benchmarks/node_engines.py [--hosts 500] [--latency 2] [--engine all|thread|async]
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import asyncssh  # noqa: E402
+
+from utils import config_obj  # noqa: E402
+
+if not config_obj.has_section('kubernetes'):
+    config_obj.read(os.path.join(ROOT, 'config.ini.sample'))
+
+import nodecollect  # noqa: E402
+from nodecollect import AllRun, AsyncRun  # noqa: E402
+
+PORT = 2222
+PROBE_PATTERN = re.compile(r"^probe (\d+) (\S+)", re.M)
+# output of every probe command on a healthy node, commands missing here exit 0 without output
+FAKE_OUTPUT = {
+    nodecollect.DOCKER_ACTIVE_CMD: "active\n",
+    nodecollect.DOCKER_FD_CMD: "65536\n158\n",
+    nodecollect.LOAD_CMD: "OK\n0.31, 0.19, 0.16\n",
+    nodecollect.CONTRACK_CMD: "262144\n1144\n",
+    nodecollect.OPENFILE_CMD: "5568\t0\t788659\n",
+    nodecollect.PID_CMD: "267\n32768\n",
+    nodecollect.DISKIO_CMD: "sda 0.00 0.20 0.00 1.00 0.00 8.00 16.00 0.00 0.50 0.00 0.50 0.30 0.03\n",
+    nodecollect.DISKUSAGE_CMD: "/dev/sda1 50G 21G 30G 41% /\n",
+    nodecollect.NIC_LIST_CMD: "eth0\n",
+    nodecollect.NIC_SAR_CMD: "Average:        eth0    120.00    110.00     30.00     25.00      0.00      0.00      0.00\n",
+    nodecollect.NTP_SYNC_CMD: "yes\n",
+    nodecollect.NTP_OFFSET_CMD: "12us\n",
+    nodecollect.CONTAINERD_CMD: "1 containerd\n",
+    nodecollect.KUBELET_ACTIVE_CMD: "active\n",
+    nodecollect.KUBELET_HEALTH_CMD: "ok\n",
+    nodecollect.KUBEPROXY_HEALTH_CMD: "ok\n",
+}
+
+
+def fake_batch_output(command):
+    script = base64.b64decode(command.split()[1]).decode()
+    data = dict()
+    for i, encoded in PROBE_PATTERN.findall(script):
+        probe = base64.b64decode(encoded).decode()
+        rc, out = (1, "") if probe == nodecollect.ZPROCESS_CMD else (0, FAKE_OUTPUT.get(probe, ""))
+        data[i] = {"rc": rc, "out": base64.b64encode(out.encode()).decode(), "err": ""}
+    return json.dumps(data) + "\n"
+
+
+class FakeServer(asyncssh.SSHServer):
+    def begin_auth(self, username):
+        return True
+
+    def password_auth_supported(self):
+        return True
+
+    def validate_password(self, username, password):
+        return True
+
+
+def start_server(latency):
+    async def handle(process):
+        await asyncio.sleep(latency)
+        process.stdout.write(fake_batch_output(process.command))
+        process.exit(0)
+
+    loop = asyncio.new_event_loop()
+    key = asyncssh.generate_private_key('ssh-rsa')
+    loop.run_until_complete(asyncssh.create_server(FakeServer, '', PORT, server_host_keys=[key],
+                                                   process_factory=handle, backlog=1024))
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+
+def bench(name, runner):
+    start = time.perf_counter()
+    runner.concurrent_run()
+    elapsed = time.perf_counter() - start
+    result = runner.get_result()
+    nodes = sum(len(v) for r in result for v in r.values())
+    print(f"{name:<8} {elapsed:8.2f}s  {nodes} nodes checked")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hosts', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=2)
+    parser.add_argument('--engine', choices=['all', 'thread', 'async'], default='all')
+    args = parser.parse_args()
+    start_server(args.latency)
+    hosts = [[f"127.0.{2 + i // 250}.{1 + i % 250}", 'root', PORT, 'pwd', '', 'bench'] for i in range(args.hosts)]
+    print(f"{args.hosts} simulated hosts, {args.latency}s per probe")
+    if args.engine in ('all', 'async'):
+        bench('async', AsyncRun(hosts, max_concurrency=500, host_timeout=60))
+    if args.engine in ('all', 'thread'):
+        bench('thread', AllRun(hosts, max_worker=10, min_worker=10))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compare the previous regex parse_resource with the cached quantity parser and its batch form on the
+quantities of synthetic pods, most of them repeated as on a real cluster.
+
+usage: python benchmarks/parse_resource.py [quantities]
+"""
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import parse_resource, parse_resources  # noqa: E402
+
+LEGACY_PATTERN = re.compile(r"^(\d*)(\D*)$")
+LEGACY_FACTORS = {"n": 1 / 1000000000, "u": 1 / 1000000, "m": 1 / 1000, "": 1, "k": 1000, "M": 1000 ** 2,
+                  "G": 1000 ** 3, "T": 1000 ** 4, "P": 1000 ** 5, "E": 1000 ** 6, "Ki": 1024, "Mi": 1024 ** 2,
+                  "Gi": 1024 ** 3, "Ti": 1024 ** 4, "Pi": 1024 ** 5, "Ei": 1024 ** 6}
+COMMON = ["100m", "250m", "500m", "1", "2", "10m", "128Mi", "256Mi", "512Mi", "1Gi", "2Gi", "16Mi", None]
+
+
+def legacy_parse_resource(v):
+    if v is None:
+        return 0
+    match = LEGACY_PATTERN.match(v)
+    return int(match.group(1)) * LEGACY_FACTORS[match.group(2)]
+
+
+def quantities(count):
+    # one in twenty is a usage value from the metrics api, nearly unique
+    return [f"{i * 7919 % 10 ** 8}n" if i % 20 == 0 else COMMON[i % len(COMMON)] for i in range(count)]
+
+
+def bench(name, func, values):
+    start = time.perf_counter()
+    func(values)
+    print(f"{name:<22} {time.perf_counter() - start:8.4f}s")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    values = quantities(count)
+    print(f"{count} quantities, {len(set(values))} distinct")
+    bench("legacy", lambda vs: [legacy_parse_resource(v) for v in vs], values)
+    parse_resource.cache_clear()
+    bench("cached, cold", lambda vs: [parse_resource(v) for v in vs], values)
+    bench("cached, warm", lambda vs: [parse_resource(v) for v in vs], values)
+    parse_resource.cache_clear()
+    bench("batch numpy, cold", parse_resources, values)
+    bench("batch numpy, warm", parse_resources, values)
+
+
+if __name__ == "__main__":
+    main()
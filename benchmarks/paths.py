@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compare jsonpath with the compiled paths on the extractions check_cidr and check_pod_status run.
+
+usage: python benchmarks/paths.py [pods]
+"""
+import os
+import sys
+import time
+
+import jsonpath
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from paths import compile_path, compile_fields  # noqa: E402
+
+
+def pods_fixture(count):
+    return [{"metadata": {"name": f"app-{i}", "namespace": f"ns-{i % 50}"},
+             "spec": {"node_name": f"node-{i % 500}"},
+             "status": {"phase": "Running" if i % 20 else "Pending", "pod_ip": f"10.0.{i // 256 % 256}.{i % 256}"}}
+            for i in range(count)]
+
+
+def bench(name, func, pods):
+    start = time.perf_counter()
+    result = func(pods)
+    print(f"{name:<28} {time.perf_counter() - start:8.3f}s  {len(result)}")
+
+
+def main():
+    pods = pods_fixture(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
+    bench("jsonpath pod ips", lambda p: jsonpath.jsonpath(p, '$[*].status.pod_ip'), pods)
+    bench("compiled pod ips", compile_path('$[*].status.pod_ip'), pods)
+    bench("jsonpath phase per pod", lambda p: [''.join(jsonpath.jsonpath(pod, '$.status.phase')) for pod in p], pods)
+    bench("compiled name and phase", compile_fields('$.metadata.name', '$.status.phase'), pods)
+
+
+if __name__ == "__main__":
+    main()
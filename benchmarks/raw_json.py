@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compare the kubernetes model path with the raw_json fast path on a synthetic 50k pod list, every tenth pod
+is pending and lacks the fields the scheduler and kubelet fill in.
+
+usage: python benchmarks/raw_json.py [pods]
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kubernetes import client  # noqa: E402
+
+from utils import json_loads, normalize_object  # noqa: E402
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+
+def pending_pod_fixture(i):
+    return {
+        "metadata": {"name": f"app-{i}", "namespace": f"ns-{i % 50}", "uid": f"uid-{i}",
+                     "creationTimestamp": "2021-04-09T10:00:00Z"},
+        "spec": {"containers": [{"name": "main", "image": "nginx:1.19"}]},
+        "status": {"phase": "Pending"},
+    }
+
+
+def job_fixture(i):
+    status = {"startTime": "2021-04-09T10:00:01Z"}
+    status.update({0: {"active": 1}, 1: {"succeeded": 1}, 2: {"failed": 1}}[i % 3])
+    return {"metadata": {"name": f"job-{i}", "namespace": f"ns-{i % 50}"},
+            "spec": {"template": {"spec": {"containers": [{"name": "main", "image": "busybox:1.28.0"}]}}},
+            "status": status}
+
+
+def pod_fixture(i):
+    if i % 10 == 9:
+        return pending_pod_fixture(i)
+    return {
+        "metadata": {"name": f"app-{i}", "namespace": f"ns-{i % 50}", "uid": f"uid-{i}",
+                     "creationTimestamp": "2021-04-09T10:00:00Z",
+                     "labels": {"app.kubernetes.io/name": f"app-{i % 300}", "release": "stable"}},
+        "spec": {"nodeName": f"node-{i % 500}",
+                 "containers": [{"name": "main", "image": "nginx:1.19",
+                                 "resources": {"limits": {"cpu": "1", "memory": "1Gi"},
+                                               "requests": {"cpu": "100m", "memory": "128Mi"}}},
+                                {"name": "sidecar", "image": "busybox:1.28.0",
+                                 "resources": {"requests": {"cpu": "10m", "memory": "16Mi"}}}]},
+        "status": {"phase": "Running", "podIP": f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}",
+                   "hostIP": f"192.168.{i % 500 // 256}.{i % 256}", "startTime": "2021-04-09T10:00:01Z",
+                   "conditions": [{"type": "Ready", "status": "True",
+                                   "lastTransitionTime": "2021-04-09T10:00:05Z"}],
+                   "containerStatuses": [{"name": "main", "ready": True, "restartCount": i % 3,
+                                          "image": "nginx:1.19", "imageID": "", "state": {"running": {
+                                              "startedAt": "2021-04-09T10:00:03Z"}}}]},
+    }
+
+
+def bench(name, func, data):
+    start = time.perf_counter()
+    items = func(data)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<10} {elapsed:8.3f}s  {len(items)} pods")
+    return items
+
+
+def model_mode(data, model="V1Pod"):
+    item_list = client.ApiClient().deserialize(FakeResponse(data), f"{model}List")
+    return [item.to_dict() for item in item_list.items]
+
+
+def raw_mode(data, model="V1Pod"):
+    return [normalize_object(item, model) for item in json_loads(data)["items"]]
+
+
+def main():
+    pods = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    data = json.dumps({"kind": "PodList", "apiVersion": "v1", "metadata": {},
+                       "items": [pod_fixture(i) for i in range(pods)]}).encode()
+    print(f"fixture: {pods} pods, {len(data) / 1024 ** 2:.1f} MiB, decoder: {json_loads.__module__}")
+    model = bench("model", model_mode, data)
+    raw = bench("raw_json", raw_mode, data)
+    print(f"pods are equal to to_dict(): {model == raw}")
+    jobs = json.dumps({"kind": "JobList", "apiVersion": "batch/v1", "metadata": {},
+                       "items": [job_fixture(i) for i in range(30)]}).encode()
+    print(f"jobs are equal to to_dict(): {model_mode(jobs, 'V1Job') == raw_mode(jobs, 'V1Job')}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compare the size and the encode/decode time of pickle and codec.py on a synthetic multi-cluster report.
+
+usage: python benchmarks/report_codec.py [clusters] [pods per cluster]
+"""
+import datetime
+import os
+import pickle
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import codec  # noqa: E402
+from k8s import PodMetric, NodeMetric  # noqa: E402
+
+
+def cluster_fixture(c, pods):
+    now = datetime.datetime(2021, 4, 9, 10, 0, tzinfo=datetime.timezone.utc)
+    nodes = max(pods // 30, 3)
+    pod_list = [{"name": f"app-{i}", "ns": f"ns-{i % 50}", "status": "Running", "restart": i % 3,
+                 "start_time": now - datetime.timedelta(minutes=i), "ip": f"10.{c}.{i // 256 % 256}.{i % 256}",
+                 "host": f"192.168.{c}.{i % nodes}"} for i in range(pods)]
+    pod_metrics = [PodMetric(f"ns-{i % 50}", f"app-{i}", "Running", 0.012 * (i % 40), 0.1, 1.0,
+                             0.128 * (i % 20), 0.125, 1.0) for i in range(pods)]
+    node_list = [{"InternalIP": f"192.168.{c}.{i}", "Hostname": f"node-{i}", "status": "Ready",
+                  "kernel": "3.10.0-1160.el7.x86_64", "container_runtime": "docker://19.3.15", "cpu": "32",
+                  "memory": 125} for i in range(nodes)]
+    node_info = {f"192.168.{c}.{i}": {
+        "docker": {"dockerProcess": True, "docker_fd": 312}, "nodeload": {"loadaverage": [1.2, 1.1, 0.9]},
+        "contrack": {"contrack_used": 0.02}, "openfile": {"openfile_used": 0.01}, "pid": {"pid_used": 0.03},
+        "diskusage": [{"/": 41}, {"/var/lib/docker": 63}], "zprocess": {"checkpass": True},
+        "ntp": {"checkpass": True}, "containerd": {"checkpass": True}, "kubelet": {"process": True},
+        "kubeproxy": {"porthealth": True}} for i in range(nodes)}
+    return {
+        "start_time": now, "end_time": now + datetime.timedelta(minutes=3), "node_info": node_info,
+        "pods_status": {"data": [], "status": True},
+        "etcd_status": {f"192.168.{c}.{i}:2379": {"data": 0.003, "status": True} for i in range(3)},
+        "context": {"node": {"desc": "node", "result": node_list}, "pod": {"desc": "pod", "result": pod_list},
+                    "job": {"desc": "jobs", "result": []},
+                    "metric": {"nodes": [NodeMetric(f"node-{i}", 3.2, 41.5) for i in range(nodes)],
+                               "pods": pod_metrics, "saved": {"api_calls": 0, "bytes": 0}},
+                    "now": now, "fetched_at": 1617962400.0},
+    }
+
+
+def report_fixture(clusters, pods):
+    checkout = defaultdict(dict)
+    checkout["license"] = {"data": {"remain_days": 200, "remain_physical_cpu": 128}, "status": True}
+    for c in range(clusters):
+        checkout[f"cluster-{c}"] = cluster_fixture(c, pods)
+    return checkout
+
+
+def bench(name, dumps, loads, report, rounds=3):
+    data = dumps(report)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        data = dumps(report)
+    encode = (time.perf_counter() - start) / rounds
+    start = time.perf_counter()
+    for _ in range(rounds):
+        loads(data)
+    decode = (time.perf_counter() - start) / rounds
+    print(f"{name:<16} {len(data) / 2 ** 20:8.2f} MiB  encode {encode:7.3f}s  decode {decode:7.3f}s")
+
+
+def main():
+    clusters = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    pods = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    report = report_fixture(clusters, pods)
+    assert codec.loads(codec.dumps(report)) == report
+    print(f"{clusters} clusters, {pods} pods each")
+    bench("pickle", pickle.dumps, pickle.loads, report)
+    for serializer in codec.SERIALIZERS:
+        for compression in codec.COMPRESSIONS:
+            bench(f"{serializer}+{compression}", lambda r: codec.dumps(r, serializer, compression), codec.loads,
+                  report)
+
+
+if __name__ == "__main__":
+    main()
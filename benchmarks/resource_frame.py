@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Time the ResourceFrame pod metrics and namespace/node/status rollups on synthetic pods, against the same
+rollups summed in python dicts.
+
+usage: python benchmarks/resource_frame.py [pods]
+"""
+import os
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from frame import ResourceFrame, RESOURCES, GROUPS  # noqa: E402
+from k8s import PodMetric  # noqa: E402
+
+
+def pod_fixture(i):
+    containers = [{"name": "main", "resources": {"limits": {"cpu": "1", "memory": "1Gi"},
+                                                  "requests": {"cpu": "100m", "memory": "128Mi"}}},
+                  {"name": "sidecar", "resources": {"requests": {"cpu": "10m", "memory": "16Mi"}}}]
+    return {"metadata": {"name": f"app-{i}", "namespace": f"ns-{i % 200}"},
+            "spec": {"node_name": f"node-{i % 1000}", "containers": containers},
+            "status": {"phase": "Running" if i % 50 else "Pending"}}
+
+
+def dict_rollups(frame):
+    totals = frame.pod_totals()
+    result = dict()
+    for group in GROUPS:
+        sums = defaultdict(lambda: defaultdict(float))
+        for i in range(len(frame.pods)):
+            key = frame.keys[group][frame.codes[group][i]]
+            for column in RESOURCES:
+                sums[key][column] += totals[column][i]
+        result[group] = sums
+    return result
+
+
+def main():
+    pods = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    data = [pod_fixture(i) for i in range(pods)]
+    usage = {(p["metadata"]["namespace"], p["metadata"]["name"]): {"main": (0.05, 96 * 2 ** 20),
+                                                                    "sidecar": (0.001, 8 * 2 ** 20)} for p in data}
+    start = time.perf_counter()
+    frame = ResourceFrame.from_pods(data, usage)
+    print(f"build      {time.perf_counter() - start:8.3f}s  {len(frame.container_pod)} containers")
+    start = time.perf_counter()
+    metrics = frame.pod_metrics(PodMetric)
+    print(f"pod metric {time.perf_counter() - start:8.3f}s  {len(metrics)} pods")
+    start = time.perf_counter()
+    rollups = frame.rollups()
+    print(f"rollups    {time.perf_counter() - start:8.3f}s  " +
+          ", ".join(f"{len(rollups[g])} {g}" for g in GROUPS))
+    start = time.perf_counter()
+    dict_rollups(frame)
+    print(f"dict loops {time.perf_counter() - start:8.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -16,29 +16,62 @@ import ipaddress
 from pathlib import Path
 import re
 
-import jsonpath
 import requests
-from kubernetes import client
-from kubernetes.stream import stream
+from kubernetes import client, watch
 
-from clusters import K8sClusters, Cluster
-from utils import RemoteClientCompass, config_obj, parse_resource, ONE_GIBI
+from clusters import K8sClusters, Cluster, prune_api_clients
+from utils import RemoteClientCompass, SSHSessionPool, config_obj, parse_resource, ONE_GIBI
 from log import logger
-from nodecollect import nodecheck, AllRun
+from paths import compile_path, compile_fields
+from podexec import run_commands
+from nodecollect import nodecheck, AllRun, AsyncRun, asyncssh, PROBES, PROBE_TTL
+from storage import Freshness, GLOBAL_SECTIONS
+
+CLUSTER_NODES = compile_path('$.status[masters,nodes][*]')
+POD_IPS = compile_path('$[*].status.pod_ip')
+NODE_ADDRESSES = compile_path('$[*].status.addresses[*].address')
+SVC_CLUSTER_IPS = compile_path('$[*].spec.cluster_ip')
+POD_NAME_PHASE = compile_fields('$.metadata.name', '$.status.phase')
+CHECK_POD = 'check-pod'
+CHECK_POD_NS = 'default'
+CHECK_POD_LABELS = {'app': 'check-pod', 'app.kubernetes.io/managed-by': 'colombia'}
+# container waiting reasons the check pod does not recover from without a change
+CHECK_POD_FATAL_REASONS = {'ErrImagePull', 'ImagePullBackOff', 'InvalidImageName', 'CrashLoopBackOff',
+                           'CreateContainerConfigError'}
 
 
 class CheckGlobal(K8sClusters):
-    def __init__(self):
+    # check method, the checkout keys it fills and the seconds its result stays fresh,
+    # the ttl is overridden by the method name without check_ in [ttl], node info tracks every probe itself
+    checks = [('check_node_status', ['node_status'], 60), ('check_license', ['license'], 86400),
+              ('check_etcd_status', ['etcd_status'], 300),
+              ('check_component_status', ['apiserver_status', 'controller_status', 'scheduler_status'], 300),
+              ('check_volumes_status', ['volumes_status'], 600), ('check_node_info', [], None)]
+
+    def __init__(self, store=None, freshness=None, checkout=None, scheduled=False):
         super(CheckGlobal, self).__init__()
+        self.scheduled = scheduled
+        self.store = store
+        self.freshness = freshness or Freshness()
         self.k8s_conf_list = self.get_clusters_conf()
+        prune_api_clients(self.k8s_conf_list + [self.kube_conf])
         self.ssh_key_file = self.get_ssh_config()
         self.machines = self.get_machines()
         self.checkout = defaultdict(dict)
+        # clusters removed from the platform leave the report, and the expiry times of removed clusters and
+        # nodes are dropped
+        clusters = {Path(conf).name for conf in self.k8s_conf_list}
+        if checkout is not None:
+            self.checkout.update({name: data for name, data in checkout.items()
+                                  if name in GLOBAL_SECTIONS or name in clusters})
+        self.freshness.prune({''} | clusters | set(self.machines))
+        self.node_probes = dict()
+        self.ssh_pool = SSHSessionPool()
 
     def check_node_status(self):
         for cluster in self.clusters.keys():
             logger.info(f"start check cluster({cluster}) nodes status")
-            node_list = jsonpath.jsonpath(self.clusters[cluster], '$.status[masters,nodes][*]')
+            node_list = CLUSTER_NODES(self.clusters[cluster])
             not_ready_list = list()
             ready_list = list()
             for node in node_list:
@@ -107,19 +140,23 @@ class CheckGlobal(K8sClusters):
                 ssh_obj = RemoteClientCompass(master_ip, self.machines[master_ip]['spec']['auth']['user'],
                                               int(self.machines[master_ip]['spec']['sshPort']),
                                               self.machines[master_ip]['spec']['auth']['password'],
-                                              self.machines[master_ip]['spec']['auth']['key'])
-                for port in ['2379', '2381']:
-                    get_member_cmd = f'ETCDCTL_API=3 /usr/local/etcd/bin/etcdctl --cacert=/var/lib/etcd/ssl/ca.crt --cert=/var/lib/etcd/ssl/etcd.crt --key=/var/lib/etcd/ssl/etcd.key --endpoints=https://{master_ip}:{port} endpoint health'
-                    ret = ssh_obj.cmd(get_member_cmd)
-                    status = ret[0].split()[2].rstrip(":")
-                    if status == "healthy":
-                        took_time = ret[0].split()[8]
-                        self.checkout[cluster]['etcd_status'][f"{master_ip}:{port}"] = {'data': took_time,
-                                                                                        'status': True}
-                    else:
-                        self.checkout[cluster]['etcd_status'][f"{master_ip}:{port}"] = {'data': ret, 'status': False}
-                        break
-                ssh_obj.close()
+                                              self.machines[master_ip]['spec']['auth']['key'], self.ssh_pool)
+                try:
+                    for port in ['2379', '2381']:
+                        get_member_cmd = f'ETCDCTL_API=3 /usr/local/etcd/bin/etcdctl --cacert=/var/lib/etcd/ssl/ca.crt --cert=/var/lib/etcd/ssl/etcd.crt --key=/var/lib/etcd/ssl/etcd.key --endpoints=https://{master_ip}:{port} endpoint health'
+                        ret = ssh_obj.cmd(get_member_cmd)
+                        # a failed command returns its stderr or None
+                        status = ret[0].split()[2].rstrip(":") if isinstance(ret, list) and ret else None
+                        if status == "healthy":
+                            took_time = ret[0].split()[8]
+                            self.checkout[cluster]['etcd_status'][f"{master_ip}:{port}"] = {'data': took_time,
+                                                                                            'status': True}
+                        else:
+                            self.checkout[cluster]['etcd_status'][f"{master_ip}:{port}"] = {'data': ret,
+                                                                                            'status': False}
+                            break
+                finally:
+                    ssh_obj.close()
 
     def check_volumes_status(self):
         logger.info("start compass gluster volumes status")
@@ -127,54 +164,59 @@ class CheckGlobal(K8sClusters):
             ssh_obj = RemoteClientCompass(master_ip, self.machines[master_ip]['spec']['auth']['user'],
                                           int(self.machines[master_ip]['spec']['sshPort']),
                                           self.machines[master_ip]['spec']['auth']['password'],
-                                          self.machines[master_ip]['spec']['auth']['key'])
-            volumes_list_cmd = r"gluster volume list"
-            volumes_list = ssh_obj.cmd(volumes_list_cmd)
-            if volumes_list:
-                self.checkout['volumes_status']['compass-stack'] = dict()
-                for volume in volumes_list:
-                    volume = volume.rstrip("\n")
-                    logger.info(f"check compass gluster volumes {volume} brick")
-                    self.checkout['volumes_status']['compass-stack'][volume] = {'data': list(), 'status': True}
-                    volume_status_info_cmd = f"gluster volume status {volume} detail"
-                    info = ssh_obj.cmd(volume_status_info_cmd)
-                    brick_name = ""
-                    for line in info:
-                        if line.startswith("Brick"):
-                            brick_name = line.split()[-1]
-                        if line.startswith("Online"):
-                            online = line.split()[-1].strip()
-                            if online != "Y":
-                                self.checkout['volumes_status']['compass-stack'][volume]['data'].append(brick_name)
-                                self.checkout['volumes_status']['compass-stack'][volume]['status'] = False
+                                          self.machines[master_ip]['spec']['auth']['key'], self.ssh_pool)
+            try:
+                volumes_list_cmd = r"gluster volume list"
+                volumes_list = ssh_obj.cmd(volumes_list_cmd)
+                if volumes_list:
+                    self.checkout['volumes_status']['compass-stack'] = dict()
+                    for volume in volumes_list:
+                        volume = volume.rstrip("\n")
+                        logger.info(f"check compass gluster volumes {volume} brick")
+                        self.checkout['volumes_status']['compass-stack'][volume] = {'data': list(), 'status': True}
+                        volume_status_info_cmd = f"gluster volume status {volume} detail"
+                        info = ssh_obj.cmd(volume_status_info_cmd)
+                        brick_name = ""
+                        for line in info:
+                            if line.startswith("Brick"):
+                                brick_name = line.split()[-1]
+                            if line.startswith("Online"):
+                                online = line.split()[-1].strip()
+                                if online != "Y":
+                                    self.checkout['volumes_status']['compass-stack'][volume]['data'].append(brick_name)
+                                    self.checkout['volumes_status']['compass-stack'][volume]['status'] = False
+            finally:
                 ssh_obj.close()
+            if volumes_list:
                 break
         logger.info("start cargo gluster volumes status")
         ssh_obj_cargo = RemoteClientCompass(config_obj.get('cargo', 'node_ip'), config_obj.get('cargo', 'ssh_user'),
                                             int(config_obj.get('cargo', 'ssh_port')),
-                                            config_obj.get('cargo', 'ssh_pwd'), '')
-        container_list = ssh_obj_cargo.cmd(r"docker ps --format '{{.Names}}'")
-        if "gluster-container" in container_list:
-            volumes_list_cmd = r"docker exec gluster-container gluster volume list"
-            volumes_list = ssh_obj_cargo.cmd(volumes_list_cmd)
-            if volumes_list:
-                self.checkout['volumes_status']['cargo'] = dict()
-                for volume in volumes_list:
-                    volume = volume.rstrip("\n")
-                    logger.info(f"check cargo gluster volumes {volume} brick")
-                    self.checkout['volumes_status']['cargo'][volume] = {'data': list(), 'status': True}
-                    volume_status_info_cmd = f"docker exec gluster-container gluster volume status {volume} detail"
-                    info = ssh_obj_cargo.cmd(volume_status_info_cmd)
-                    brick_name = ""
-                    for line in info:
-                        if line.startswith("Brick"):
-                            brick_name = line.split()[-1]
-                        if line.startswith("Online"):
-                            online = line.split()[-1].strip()
-                            if online != "Y":
-                                self.checkout['volumes_status']['cargo'][volume]['data'].append(brick_name)
-                                self.checkout['volumes_status']['cargo'][volume]['status'] = False
-                ssh_obj_cargo.close()
+                                            config_obj.get('cargo', 'ssh_pwd'), '', self.ssh_pool)
+        try:
+            container_list = ssh_obj_cargo.cmd(r"docker ps --format '{{.Names}}'")
+            if "gluster-container" in container_list:
+                volumes_list_cmd = r"docker exec gluster-container gluster volume list"
+                volumes_list = ssh_obj_cargo.cmd(volumes_list_cmd)
+                if volumes_list:
+                    self.checkout['volumes_status']['cargo'] = dict()
+                    for volume in volumes_list:
+                        volume = volume.rstrip("\n")
+                        logger.info(f"check cargo gluster volumes {volume} brick")
+                        self.checkout['volumes_status']['cargo'][volume] = {'data': list(), 'status': True}
+                        volume_status_info_cmd = f"docker exec gluster-container gluster volume status {volume} detail"
+                        info = ssh_obj_cargo.cmd(volume_status_info_cmd)
+                        brick_name = ""
+                        for line in info:
+                            if line.startswith("Brick"):
+                                brick_name = line.split()[-1]
+                            if line.startswith("Online"):
+                                online = line.split()[-1].strip()
+                                if online != "Y":
+                                    self.checkout['volumes_status']['cargo'][volume]['data'].append(brick_name)
+                                    self.checkout['volumes_status']['cargo'][volume]['status'] = False
+        finally:
+            ssh_obj_cargo.close()
 
     def load_busybox_image(self):
         logger.info(f"load and push busybox image")
@@ -187,62 +229,120 @@ class CheckGlobal(K8sClusters):
 
     def check_node_info(self):
         for cluster in self.clusters.keys():
-            self.checkout[cluster]['node_info'] = dict()
+            # drop nodes removed from the cluster since the previous report
+            for key in ['node_info', 'node_failures']:
+                nodes = self.checkout[cluster].setdefault(key, dict())
+                for ip in [ip for ip in nodes if self.machines.get(ip, {}).get('spec', {}).get('cluster') != cluster]:
+                    del nodes[ip]
         nodes_list = list()
         for machine in self.machines.keys():
             # logger.info(f"check node {machine} info")
-            n = []
-            n.insert(0, machine)
             cluster = self.machines[machine]['spec']['cluster']
-            if cluster:
-                user = self.machines[machine]['spec']['auth']['user']
-                ssh_port = int(self.machines[machine]['spec']['sshPort'])
-                pwd = self.machines[machine]['spec']['auth']['password']
-                key = self.machines[machine]['spec']['auth']['key']
-                n.insert(1, user)
-                n.insert(2, ssh_port)
-                n.insert(3, pwd)
-                n.insert(4, key)
-                n.insert(5, cluster)
-            nodes_list.append(n)
-        a = AllRun(nodes_list)
+            if not cluster:
+                continue
+            probes = [probe for probe in PROBES if not self.freshness.fresh(machine, f"node_{probe}")]
+            if not probes:
+                continue
+            user = self.machines[machine]['spec']['auth']['user']
+            ssh_port = int(self.machines[machine]['spec']['sshPort'])
+            pwd = self.machines[machine]['spec']['auth']['password']
+            key = self.machines[machine]['spec']['auth']['key']
+            nodes_list.append([machine, user, ssh_port, pwd, key, cluster, probes])
+        logger.info(f"{len(nodes_list)} of {len(self.machines)} nodes have expired probes")
+        # scheduled runs spread the ssh work over several runs, the longest expired nodes go first;
+        # manual runs check every expired node
+        max_nodes = config_obj.getint('schedule', 'max_nodes', fallback=200)
+        if self.scheduled and max_nodes and not self.freshness.force and len(nodes_list) > max_nodes:
+            nodes_list.sort(key=lambda n: min(self.freshness.expiry(n[0], f"node_{p}") for p in n[6]))
+            nodes_list = nodes_list[:max_nodes]
+            logger.info(f"check {max_nodes} nodes in this run, the others wait for the next one")
+        if not nodes_list:
+            return
+        self.node_probes = {node[0]: node[6] for node in nodes_list}
+        engine = config_obj.get('node', 'engine', fallback='thread')
+        if engine == 'async' and asyncssh is not None:
+            a = AsyncRun(nodes_list, listener=self.node_done)
+        else:
+            if engine == 'async':
+                logger.error("asyncssh is not installed, check nodes with the thread engine")
+            a = AllRun(nodes_list, pool=self.ssh_pool, listener=self.node_done)
         a.concurrent_run()
-        r = a.get_result()
-        for i in r:
-            for k, v in i.items():
-                self.checkout[k]['node_info'].update(v)
+
+    def node_done(self, cluster, ip, result, error):
+        if error is None:
+            # an incremental check only returns the expired probes, keep the fresh ones
+            node = self.checkout[cluster].setdefault('node_info', dict()).setdefault(ip, dict())
+            node.update(result)
+            result = node
+            self.checkout[cluster].get('node_failures', dict()).pop(ip, None)
+            for probe in self.node_probes.get(ip, PROBES):
+                self.freshness.mark(ip, f"node_{probe}", self.freshness.ttl(f"node_{probe}", PROBE_TTL[probe]))
+        else:
+            self.checkout[cluster].setdefault('node_failures', dict())[ip] = error
+            result = {'error': error, 'status': False}
+        if self.store is not None:
+            self.store.publish('node', cluster, ip, result)
 
     # ssh_obj = nodecheck(machine, user, ssh_port, pwd, key)
     # self.checkout[cluster]['node_info'][machine] = ssh_obj.start_check()
     # ssh_obj.close()
 
     def start_check(self):
-        self.check_node_status()
-        self.check_license()
-        self.check_etcd_status()
-        self.check_component_status()
-        self.check_volumes_status()
-        self.check_node_info()
+        try:
+            for check, keys, ttl in self.checks:
+                name = check[len('check_'):]
+                if ttl is not None and self.freshness.fresh('', name):
+                    logger.info(f"{name} is still fresh, skip it")
+                    continue
+                getattr(self, check)()
+                if ttl is not None:
+                    self.freshness.mark('', name, self.freshness.ttl(name, ttl))
+                if self.store is not None:
+                    self.store.publish_checks(self.checkout, keys, self.clusters.keys())
+        finally:
+            self.ssh_pool.close_all()
 
 
 class CheckK8s(Cluster):
-    def __init__(self, kube_conf, checkout):
+    # check method, the checkout keys it fills and the seconds its result stays fresh,
+    # the ttl is overridden by the method name without check_ in [ttl]
+    checks = [('check_cidr', ['pod_cidr', 'svc_cidr'], 600), ('check_pod_status', ['pods_status'], 60),
+              ('check_coredns_status', ['coredns_status'], 300),
+              ('check_clusters_quotas', ['cluster_quota'], 600), ('check_tenants_quotas', ['tenants_quota'], 600),
+              ('check_partitions_quotas', ['partitions_quota'], 600), ('check_dns', ['dns_nslookup'], 600),
+              ('check_network', ['network'], 600)]
+    # checks that exec in the check pod
+    pod_checks = ['check_dns', 'check_network']
+
+    def __init__(self, kube_conf, checkout, store=None, freshness=None):
         super(CheckK8s, self).__init__(kube_conf)
         self.cluster_name = Path(kube_conf).name
         self.checkout = checkout
-        self.pod_list = self.get_pods()
-        self.svc_list = self.get_svc()
-        self.nodes = self.get_node()
+        self.store = store
+        self.freshness = freshness or Freshness()
+
+    def expired_checks(self):
+        return [(check, keys, ttl) for check, keys, ttl in self.checks
+                if not self.freshness.fresh(self.cluster_name, check[len('check_'):])]
+
+    def need_check_pod(self):
+        return any(check in self.pod_checks for check, _, _ in self.expired_checks())
 
     def check_cidr(self):
         logger.info(f"check {self.cluster_name} cidr")
         cluster_info = self.get_cm('cluster-info', 'kube-system')
         pod_cidr_ip_num = ipaddress.ip_network(cluster_info['data']['cidr'], strict=True).num_addresses
         svc_cidr_ip_num = ipaddress.ip_network(cluster_info['data']['serviceIPRange'], strict=True).num_addresses
-        pod_ip_list = jsonpath.jsonpath(self.pod_list, '$.items[*].status.pod_ip')
-        node_ip_list = jsonpath.jsonpath(self.nodes, '$.items[*].status.addresses[*].address')
-        svc_ip_used = len(jsonpath.jsonpath(self.svc_list, '$.items[*].spec.cluster_ip'))
-        pod_ip_used = len(set(pod_ip_list) - set(node_ip_list))
+        pod_ip_set = set()
+        for page in self.snapshot.pages('pods'):
+            pod_ip_set.update(POD_IPS(page))
+        node_ip_set = set()
+        for page in self.snapshot.pages('node'):
+            node_ip_set.update(NODE_ADDRESSES(page))
+        svc_ip_used = 0
+        for page in self.snapshot.pages('svc'):
+            svc_ip_used += len(SVC_CLUSTER_IPS(page))
+        pod_ip_used = len(pod_ip_set - node_ip_set)
         pod_status = True if pod_ip_used < pod_cidr_ip_num * 0.8 else False
         svc_status = True if svc_ip_used < svc_cidr_ip_num * 0.8 else False
         self.checkout[self.cluster_name]['pod_cidr'] = {'data': {'used': pod_ip_used, 'quota': pod_cidr_ip_num},
@@ -252,16 +352,16 @@ class CheckK8s(Cluster):
 
     def check_pod_status(self):
         logger.info(f"check {self.cluster_name} pods status")
-        status_list = jsonpath.jsonpath(self.pod_list, '$.items[*].status.phase')
-        pod_status = {x['metadata']['name']: {
-            'restart': sum(jsonpath.jsonpath(x, '$.status.container_statuses[*].restart_count')),
-            'phase': ''.join(jsonpath.jsonpath(x, '$.status.phase'))} for x in self.pod_list['items']}
-        pod_checkout = {x: {'data': 0, 'status': True, 'name': []} for x in status_list}
-        for pod in pod_status.keys():
-            pod_checkout[pod_status[pod]['phase']]['data'] += 1
-            if pod_status[pod]['phase'] not in ['Running', 'Succeeded']:
-                pod_checkout[pod_status[pod]['phase']]['status'] = False
-                pod_checkout[pod_status[pod]['phase']]['name'].append(pod)
+        pod_checkout = dict()
+        for page in self.snapshot.pages('pods'):
+            for name, phase in POD_NAME_PHASE(page):
+                phase = phase or ''
+                if phase not in pod_checkout:
+                    pod_checkout[phase] = {'data': 0, 'status': True, 'name': []}
+                pod_checkout[phase]['data'] += 1
+                if phase not in ['Running', 'Succeeded']:
+                    pod_checkout[phase]['status'] = False
+                    pod_checkout[phase]['name'].append(name)
         self.checkout[self.cluster_name]['pods_status'] = pod_checkout
 
     def check_coredns_status(self):
@@ -400,38 +500,46 @@ class CheckK8s(Cluster):
         data = self.__get_checkout_for_tenant_and_partitions(partitions)
         self.checkout[self.cluster_name]['partitions_quota'] = data
 
-    def pod_exec(self, name, ns, cmd):
-        resp = stream(self.core_v1_api.connect_get_namespaced_pod_exec, name, ns,
-                      command=cmd, stderr=True, stdin=True, stdout=True, tty=False)
-        return resp
+    def run_probes(self, commands):
+        """
+        Run the commands in the check pod in parallel through one exec session.
+
+        :return: (returncode, output) of every command, returncode None when it did not finish in time
+        """
+        timeout = config_obj.getint('kubernetes', 'probe_timeout', fallback=300)
+        parallel = config_obj.getint('kubernetes', 'probe_parallel', fallback=50)
+        start = time.monotonic()
+        results = run_commands(self.core_v1_api, CHECK_POD, CHECK_POD_NS, commands, timeout, parallel)
+        logger.info(f"{self.cluster_name} {len(commands)} probes run in {time.monotonic() - start:.1f}s")
+        return results
 
     def check_dns(self):
         logger.info(f"check {self.cluster_name} dns nslookup")
         external_domain = config_obj.get('kubernetes', 'externalDomain').split()
         internal_domain = config_obj.get('kubernetes', 'internalDomain').split()
         external_domain.extend(internal_domain)
-        name = 'check-pod'
-        ns = 'default'
         self.checkout[self.cluster_name]['dns_nslookup'] = {'data': [], 'status': True}
-        for domain in external_domain:
-            cmd = ['nslookup', domain]
-            self.pod_exec(name, ns, cmd)
-            resp = self.pod_exec(name, ns, cmd)
-            pattern = re.compile("can't resolve")
-            result = pattern.findall(resp)
-            if result:
-                status = False
+        # a lookup is tried twice, the first one after the pod starts may time out
+        results = self.run_probes([[['nslookup', domain], ['nslookup', domain]] for domain in external_domain])
+        pattern = re.compile("can't resolve")
+        for domain, (rc, resp) in zip(external_domain, results):
+            if rc != 0 or pattern.findall(resp):
                 self.checkout[self.cluster_name]['dns_nslookup']['data'].append(domain)
-                self.checkout[self.cluster_name]['dns_nslookup']['status'] = status
+                self.checkout[self.cluster_name]['dns_nslookup']['status'] = False
 
     def __get_node_pod_ip(self):
         node_pod_ip = dict()
-        for pod in self.pod_list['items']:
-            node_ip = pod['status']['host_ip']
-            pod_ip = pod['status']['pod_ip']
-            if node_ip not in node_pod_ip.keys():
-                node_pod_ip[node_ip] = list()
-            node_pod_ip[node_ip].append(pod_ip)
+        for page in self.snapshot.pages('pods'):
+            for pod in page:
+                node_ip = pod['status']['host_ip']
+                pod_ip = pod['status']['pod_ip']
+                # pending pods have no node or no ip yet
+                if node_ip is None:
+                    continue
+                if node_ip not in node_pod_ip.keys():
+                    node_pod_ip[node_ip] = list()
+                if pod_ip is not None:
+                    node_pod_ip[node_ip].append(pod_ip)
         for node in node_pod_ip.keys():
             node_pod_ip[node] = set(node_pod_ip[node]) - set(node_pod_ip.keys())
         return node_pod_ip
@@ -439,59 +547,134 @@ class CheckK8s(Cluster):
     def check_network(self):
         logger.info(f"check {self.cluster_name} network：pod -> node; pod -> pod (diff node)")
         ip_dict = self.__get_node_pod_ip()
-        name = 'check-pod'
-        ns = 'default'
         self.checkout[self.cluster_name]['network'] = dict()
         self.checkout[self.cluster_name]['network']["pod_to_node"] = {'data': [], 'status': True}
         self.checkout[self.cluster_name]['network']["pod_to_pod"] = {'data': [], 'status': True}
-        for node in ip_dict.keys():
-            cmd = ['ping', '-c', '2', node]
-            resp = self.pod_exec(name, ns, cmd)
-            pattern = re.compile(", 0% packet loss")
-            result = pattern.findall(resp)
-            if not result:
-                self.checkout[self.cluster_name]['network']["pod_to_node"]['data'].append(node)
-                self.checkout[self.cluster_name]['network']["pod_to_node"]['status'] = False
-            pod_ip = list(ip_dict[node])[0]
-            cmd1 = ['ping', '-c', '2', pod_ip]
-            resp1 = self.pod_exec(name, ns, cmd1)
-            result1 = pattern.findall(resp1)
-            if not result1:
-                self.checkout[self.cluster_name]['network']["pod_to_pod"]['data'].append(pod_ip)
-                self.checkout[self.cluster_name]['network']["pod_to_pod"]['status'] = False
+        # (check, target ip) of every ping, one node and one pod on it per node
+        targets = list()
+        for node, pod_ips in ip_dict.items():
+            targets.append(("pod_to_node", node))
+            if pod_ips:
+                targets.append(("pod_to_pod", sorted(pod_ips)[0]))
+        results = self.run_probes([['ping', '-c', '2', '-w', '10', ip] for _, ip in targets])
+        pattern = re.compile(", 0% packet loss")
+        for (key, ip), (_, resp) in zip(targets, results):
+            if not pattern.findall(resp):
+                self.checkout[self.cluster_name]['network'][key]['data'].append(ip)
+                self.checkout[self.cluster_name]['network'][key]['status'] = False
+
+    def watch_check_pod(self, timeout):
+        """
+        Yield the events of the check pod until timeout seconds passed.
+        """
+        deadline = time.monotonic() + timeout
+        w = watch.Watch()
+        try:
+            while time.monotonic() < deadline:
+                remaining = max(int(deadline - time.monotonic()), 1)
+                for event in w.stream(self.core_v1_api.list_namespaced_pod, CHECK_POD_NS,
+                                      field_selector=f"metadata.name={CHECK_POD}", timeout_seconds=remaining,
+                                      _request_timeout=remaining + 5):
+                    yield event['type'], event['object']
+                    if time.monotonic() >= deadline:
+                        return
+        finally:
+            w.stop()
+
+    def wait_check_pod_running(self, timeout):
+        for event, pod in self.watch_check_pod(timeout):
+            if event == 'DELETED' or pod.status.phase in ('Succeeded', 'Failed'):
+                logger.error(f"{self.cluster_name} check pod ended with phase {pod.status.phase}")
+                return False
+            if pod.status.phase == 'Running':
+                return True
+            for status in pod.status.container_statuses or []:
+                waiting = status.state.waiting if status.state is not None else None
+                if waiting is not None and waiting.reason in CHECK_POD_FATAL_REASONS:
+                    logger.error(f"{self.cluster_name} check pod can not start: {waiting.reason} {waiting.message}")
+                    return False
+        logger.error(f"{self.cluster_name} check pod is not running after {timeout}s")
+        return False
+
+    def wait_check_pod_deleted(self, timeout):
+        # polled: with no grace period the pod may be gone before a watch started now lists it
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                self.core_v1_api.read_namespaced_pod(CHECK_POD, CHECK_POD_NS)
+            except client.exceptions.ApiException as err:
+                if err.status == 404:
+                    return True
+                raise
+            time.sleep(1)
+        return False
 
     def create_check_pod(self, image):
-        logger.info(f"{self.cluster_name} create check pod")
-        while True:
-            try:
-                self.core_v1_api.read_namespaced_pod('check-pod', 'default')
-            except client.exceptions.ApiException:
-                check_pod = {'apiVersion': 'v1', 'kind': 'Pod',
-                             'metadata': {'name': 'check-pod', 'labels': {'app': 'check-pod'}},
-                             'spec': {'containers': [{'name': 'busybox', 'image': image,
-                                                      'command': ['sh', '-c',
-                                                                  'echo Hello Kubernetes! && sleep 3600']}]}}
-                self.core_v1_api.create_namespaced_pod('default', body=check_pod)
-
-            resp = self.core_v1_api.read_namespaced_pod('check-pod', 'default').to_dict()
-            if resp['status']['phase'] != 'Running':
-                time.sleep(5)
-            else:
+        """
+        Start the check pod and wait for it with a watch until check_pod_timeout. A running check pod kept by
+        an earlier run with the same image is reused.
+
+        :return: whether the check pod is running
+        """
+        timeout = config_obj.getint('kubernetes', 'check_pod_timeout', fallback=180)
+        try:
+            pod = self.core_v1_api.read_namespaced_pod(CHECK_POD, CHECK_POD_NS)
+        except client.exceptions.ApiException as err:
+            if err.status != 404:
+                logger.error(f"{self.cluster_name} can not read the check pod, skip the pod checks: {err}")
+                return False
+            pod = None
+        if pod is not None:
+            if pod.metadata.deletion_timestamp is None and pod.status.phase == 'Running' and \
+                    pod.spec.containers[0].image == image:
+                logger.info(f"{self.cluster_name} reuse the running check pod")
                 return True
+            if pod.metadata.deletion_timestamp is None and pod.status.phase == 'Pending' and \
+                    pod.spec.containers[0].image == image:
+                return self.wait_check_pod_running(timeout)
+            logger.info(f"{self.cluster_name} replace the check pod in phase {pod.status.phase}")
+            self.del_check_pod()
+            if not self.wait_check_pod_deleted(timeout):
+                logger.error(f"{self.cluster_name} old check pod is not deleted after {timeout}s")
+                return False
+        logger.info(f"{self.cluster_name} create check pod")
+        check_pod = {'apiVersion': 'v1', 'kind': 'Pod',
+                     'metadata': {'name': CHECK_POD, 'labels': CHECK_POD_LABELS},
+                     'spec': {'terminationGracePeriodSeconds': 0,
+                              'containers': [{'name': 'busybox', 'image': image,
+                                              'command': ['sh', '-c', 'while true; do sleep 3600; done']}]}}
+        try:
+            self.core_v1_api.create_namespaced_pod(CHECK_POD_NS, body=check_pod)
+        except client.exceptions.ApiException as err:
+            logger.error(f"{self.cluster_name} can not create the check pod, skip the pod checks: {err}")
+            return False
+        return self.wait_check_pod_running(timeout)
 
     def del_check_pod(self):
         try:
-            self.core_v1_api.delete_namespaced_pod('check-pod', 'default')
-            logger.info('delete check-pod in default ns')
+            self.core_v1_api.delete_namespaced_pod(CHECK_POD, CHECK_POD_NS)
+            logger.info(f'delete {CHECK_POD} in {CHECK_POD_NS} ns')
         except client.exceptions.ApiException:
-            logger.info('pod check-pod not in default')
-
-    def start_check(self):
-        self.check_cidr()
-        self.check_pod_status()
-        self.check_coredns_status()
-        self.check_clusters_quotas()
-        self.check_tenants_quotas()
-        self.check_partitions_quotas()
-        self.check_dns()
-        self.check_network()
+            logger.info(f'pod {CHECK_POD} not in {CHECK_POD_NS}')
+
+    def release_check_pod(self):
+        """
+        Delete the check pod after the run unless keep_probe_pod keeps it for the next runs.
+        """
+        if config_obj.getboolean('kubernetes', 'keep_probe_pod', fallback=False):
+            logger.info(f"{self.cluster_name} keep the check pod for the next run")
+            return
+        self.del_check_pod()
+
+    def start_check(self, pod_ready=True):
+        """
+        Run the expired checks, the ones needing the check pod are left expired when it is not ready.
+        """
+        for check, keys, ttl in self.expired_checks():
+            if check in self.pod_checks and not pod_ready:
+                continue
+            name = check[len('check_'):]
+            getattr(self, check)()
+            self.freshness.mark(self.cluster_name, name, self.freshness.ttl(name, ttl))
+            if self.store is not None:
+                self.store.publish_checks(self.checkout, keys, [self.cluster_name])
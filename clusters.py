@@ -13,20 +13,103 @@
 # Built-in
 import yaml
 import base64
+import datetime
+import hashlib
 import os
+from threading import Lock
 # others
 from kubernetes import client, config
+from kubernetes.client import rest
 # project
-from utils import config_obj, base_request, base_header
+from utils import config_obj, base_request, base_header, json_loads, normalize_object
+from log import logger
+
+
+# times a paged list starts again after its continue token expired
+LIST_RESTARTS = 3
+
+# kubeconfig path -> (digest of its contents, ReloadingApiClient)
+API_CLIENTS = dict()
+API_CLIENTS_LOCK = Lock()
+
+
+def load_configuration(kube_conf) -> client.Configuration:
+    configuration = client.Configuration()
+    config.load_kube_config(kube_conf, client_configuration=configuration, persist_config=False)
+    configuration.connection_pool_maxsize = config_obj.getint("kubernetes", "connection_pool_size", fallback=10)
+    return configuration
+
+
+class ReloadingApiClient(client.ApiClient):
+    """
+    ApiClient that loads its kubeconfig again and retries once when a request gets 401, so expired tokens
+    and exec plugin credentials are refreshed without restarting the process.
+    """
+
+    def __init__(self, kube_conf):
+        self.kube_conf = kube_conf
+        self.__lock = Lock()
+        super(ReloadingApiClient, self).__init__(load_configuration(kube_conf))
+
+    def reload(self, configuration):
+        """
+        Load the kubeconfig unless another thread already did since configuration was used.
+        """
+        with self.__lock:
+            if self.configuration is not configuration:
+                return
+            logger.info(f"reload api client for {self.kube_conf}")
+            self.rest_client.pool_manager.clear()
+            self.configuration = load_configuration(self.kube_conf)
+            self.rest_client = rest.RESTClientObject(self.configuration)
+
+    def call_api(self, *args, **kwargs):
+        configuration = self.configuration
+        try:
+            return super(ReloadingApiClient, self).call_api(*args, **kwargs)
+        except client.exceptions.ApiException as err:
+            if err.status != 401:
+                raise
+            logger.warning(f"{self.kube_conf} is unauthorized, retry with the credentials loaded again")
+            self.reload(configuration)
+            return super(ReloadingApiClient, self).call_api(*args, **kwargs)
+
+
+def get_api_client(kube_conf) -> client.ApiClient:
+    """
+    Dedicated ApiClient of a kubeconfig, the process-global default configuration is never touched.
+    Clients are cached per kubeconfig so TLS setup and connection pools survive across runs, a kubeconfig
+    whose contents changed gets a new one.
+    """
+    with open(kube_conf, "rb") as kf:
+        digest = hashlib.sha256(kf.read()).hexdigest()
+    with API_CLIENTS_LOCK:
+        cached = API_CLIENTS.get(kube_conf)
+        if cached is None or cached[0] != digest:
+            if cached is not None:
+                cached[1].rest_client.pool_manager.clear()
+            API_CLIENTS[kube_conf] = (digest, ReloadingApiClient(kube_conf))
+            logger.info(f"create api client for {kube_conf}")
+        return API_CLIENTS[kube_conf][1]
+
+
+def prune_api_clients(kube_confs):
+    """
+    Drop the cached clients of the kubeconfigs not in kube_confs, clusters removed from the platform.
+    """
+    with API_CLIENTS_LOCK:
+        for kube_conf in [k for k in API_CLIENTS if k not in kube_confs]:
+            logger.info(f"drop api client for {kube_conf}")
+            API_CLIENTS.pop(kube_conf)[1].rest_client.pool_manager.clear()
 
 
 class K8sClusters:
 
     def __init__(self):
         self.kube_conf = config_obj.get("kubernetes", "k8s_conf_path")
-        config.load_kube_config(self.kube_conf)
-        self.custom_api = client.CustomObjectsApi()
-        self.core_api = client.CoreV1Api()
+        self.api_client = get_api_client(self.kube_conf)
+        self.custom_api = client.CustomObjectsApi(self.api_client)
+        self.core_api = client.CoreV1Api(self.api_client)
         self.clusters = self.get_clusters()
 
     def get_clusters(self) -> dict:
@@ -102,14 +185,53 @@ class K8sClusters:
         return cluster_info
 
 
+class ClusterSnapshot:
+    """
+    Resources of one cluster shared by every check and report builder. By default every kind is listed at
+    most once per run and kept. With snapshot_retain = false nothing is kept: every consumer streams the
+    pages again, which trades apiserver calls for a memory peak bounded by page_size.
+    """
+
+    def __init__(self, cluster):
+        self.cluster = cluster
+        self.retain = config_obj.getboolean("kubernetes", "snapshot_retain", fallback=True)
+        self.resources = dict()
+        self.fetched_at = dict()
+        self.__lock = Lock()
+        self.__kind_locks = dict()
+
+    def kind_lock(self, kind):
+        with self.__lock:
+            return self.__kind_locks.setdefault(kind, Lock())
+
+    def pages(self, kind):
+        if self.retain:
+            yield self.get(kind)["items"]
+            return
+        self.fetched_at[kind] = datetime.datetime.now()
+        yield from getattr(self.cluster, f"iter_{kind}")()
+
+    def get(self, kind) -> dict:
+        if not self.retain:
+            return {"items": [item for page in self.pages(kind) for item in page]}
+        # concurrent consumers of a kind wait for the first one's list instead of listing it again
+        with self.kind_lock(kind):
+            if kind not in self.resources:
+                self.fetched_at[kind] = datetime.datetime.now()
+                pages = getattr(self.cluster, f"iter_{kind}")()
+                self.resources[kind] = {"items": [item for page in pages for item in page]}
+        return self.resources[kind]
+
+
 class Cluster:
-    def __init__(self, kube_conf):
+    def __init__(self, kube_conf, snapshot=None):
         self.kube_conf = kube_conf
-        config.load_kube_config(self.kube_conf)
-        self.custom_api = client.CustomObjectsApi()
-        self.core_v1_api = client.CoreV1Api()
-        self.app_v1_api = client.AppsV1Api()
-        self.batch_v1_api = client.BatchV1Api()
+        self.api_client = get_api_client(self.kube_conf)
+        self.custom_api = client.CustomObjectsApi(self.api_client)
+        self.core_v1_api = client.CoreV1Api(self.api_client)
+        self.app_v1_api = client.AppsV1Api(self.api_client)
+        self.batch_v1_api = client.BatchV1Api(self.api_client)
+        self.snapshot = snapshot if snapshot is not None else ClusterSnapshot(self)
 
     def get_partitions(self) -> dict:
         partitions_obj = self.custom_api.list_cluster_custom_object("tenant.caicloud.io", "v1alpha1", "partitions")
@@ -128,9 +250,60 @@ class Cluster:
 
         return clusterquotas
 
+    @staticmethod
+    def list_pages(list_func, model, **kwargs):
+        """
+        Yield the items of a list call page by page with limit/_continue, every page is turned into dicts
+        on its own so only one page of model objects is alive at a time. page_size = 0 disables paging.
+        With raw_json = true the models are skipped: the response bytes are decoded straight into dicts
+        shaped like the model class named model.
+        When the continue token expired (410 Gone) the list starts again from the first page. Items come in
+        namespace/name order, so the ones up to the last yielded item are skipped instead of yielded twice.
+        """
+        page_size = config_obj.getint("kubernetes", "page_size", fallback=500)
+        raw_json = config_obj.getboolean("kubernetes", "raw_json", fallback=False)
+        if page_size:
+            kwargs["limit"] = page_size
+        last_key = None
+        restarts = 0
+        while True:
+            try:
+                if raw_json:
+                    data = json_loads(list_func(_preload_content=False, **kwargs).data)
+                    page = [normalize_object(item, model) for item in data["items"]]
+                    _continue = data["metadata"].get("continue")
+                else:
+                    resp = list_func(**kwargs)
+                    page = [item.to_dict() for item in resp.items]
+                    _continue = resp.metadata._continue
+            except client.exceptions.ApiException as err:
+                if err.status != 410 or "_continue" not in kwargs or restarts >= LIST_RESTARTS:
+                    raise
+                restarts += 1
+                logger.warning(f"{list_func.__name__} continue token expired, list again from the first page")
+                del kwargs["_continue"]
+                continue
+            if restarts and last_key is not None:
+                page = [item for item in page if Cluster.item_key(item) > last_key]
+            if page:
+                last_key = Cluster.item_key(page[-1])
+            yield page
+            if not page_size or not _continue:
+                break
+            logger.debug(f"{list_func.__name__} continue after {page_size} items")
+            kwargs["_continue"] = _continue
+
+    @staticmethod
+    def item_key(item):
+        # the order of the apiserver's storage keys, code point order of str is the byte order of utf-8
+        metadata = item["metadata"]
+        return f"{metadata['namespace']}/{metadata['name']}" if metadata.get("namespace") else metadata["name"]
+
+    def iter_pods(self):
+        return self.list_pages(self.core_v1_api.list_pod_for_all_namespaces, "V1Pod")
+
     def get_pods(self) -> dict:
-        pods_obj = self.core_v1_api.list_pod_for_all_namespaces().to_dict()
-        return pods_obj
+        return self.snapshot.get("pods")
 
     def get_deployments(self) -> dict:
         deployments_obj = self.app_v1_api.list_deployment_for_all_namespaces().to_dict()
@@ -141,14 +314,24 @@ class Cluster:
                                                                         name='coredns').to_dict()
         return coredns_obj
 
+    def iter_svc(self):
+        return self.list_pages(self.core_v1_api.list_service_for_all_namespaces, "V1Service")
+
     def get_svc(self) -> dict:
-        svc_obj = self.core_v1_api.list_service_for_all_namespaces().to_dict()
-        return svc_obj
+        return self.snapshot.get("svc")
+
+    def iter_jobs(self):
+        return self.list_pages(self.batch_v1_api.list_job_for_all_namespaces, "V1Job")
+
+    def get_jobs(self) -> dict:
+        return self.snapshot.get("jobs")
 
     def get_cm(self, name, ns) -> dict:
         cluster_info = self.core_v1_api.read_namespaced_config_map(name, ns).to_dict()
         return cluster_info
 
+    def iter_node(self):
+        return self.list_pages(self.core_v1_api.list_node, "V1Node")
+
     def get_node(self) -> dict:
-        nodes_obj = self.core_v1_api.list_node().to_dict()
-        return nodes_obj
+        return self.snapshot.get("node")
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+typed report serialization replacing pickle: msgpack, or json when msgpack is not installed, compressed with
+zstd, or zlib when zstandard is not installed
+
+an encoded value starts with the 4 byte header ``CR``, the format version and a flag byte naming the
+serializer and the compression. Only the types in RESTORERS are rebuilt on decode, nothing is executed, so
+a report read from a shared redis can not run code the way an unpickled one can.
+"""
+import datetime
+import json
+import numbers
+import zlib
+from collections import defaultdict
+
+from k8s import PodMetric, NodeMetric
+from utils import config_obj
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b"CR"
+FORMAT_VERSION = 1
+SERIALIZERS = {"msgpack": 0, "json": 1}
+COMPRESSIONS = {"none": 0, "zlib": 1, "zstd": 2}
+# payloads smaller than this are not worth compressing
+COMPRESS_MIN_SIZE = 512
+# tag of every non native type and its msgpack ext code
+EXT_CODES = {"datetime": 1, "date": 2, "timedelta": 3, "tuple": 4, "set": 5, "defaultdict": 6, "map": 7,
+             "PodMetric": 8, "NodeMetric": 9}
+TAGS = {code: tag for tag, code in EXT_CODES.items()}
+DEFAULT_FACTORIES = {"dict": dict, "list": list, "set": set, "int": int}
+
+
+def reduce(obj, str_keys):
+    """
+    Tag and plain value of a non native object, the plain value is rebuilt by RESTORERS[tag].
+
+    :param str_keys: the serializer only takes str dict keys, other dicts are written as pairs
+    """
+    # namedtuples before tuple, datetime before date
+    if isinstance(obj, PodMetric):
+        return "PodMetric", list(obj)
+    if isinstance(obj, NodeMetric):
+        return "NodeMetric", list(obj)
+    if isinstance(obj, tuple):
+        return "tuple", list(obj)
+    if isinstance(obj, datetime.datetime):
+        return "datetime", obj.isoformat()
+    if isinstance(obj, datetime.date):
+        return "date", obj.isoformat()
+    if isinstance(obj, datetime.timedelta):
+        return "timedelta", obj.total_seconds()
+    if isinstance(obj, (set, frozenset)):
+        return "set", list(obj)
+    if isinstance(obj, defaultdict):
+        factory = obj.default_factory.__name__ if obj.default_factory is not None else None
+        if factory is not None and factory not in DEFAULT_FACTORIES:
+            raise TypeError(f"can not encode defaultdict({factory})")
+        return "defaultdict", [factory, [[k, v] for k, v in obj.items()]]
+    if isinstance(obj, dict):
+        if str_keys and not all(isinstance(k, str) for k in obj):
+            return "map", [[k, v] for k, v in obj.items()]
+        return None, dict(obj)
+    if isinstance(obj, list):
+        return None, list(obj)
+    if isinstance(obj, str):
+        return None, str(obj)
+    # numpy and other numeric scalars
+    if isinstance(obj, numbers.Integral):
+        return None, int(obj)
+    if isinstance(obj, numbers.Real):
+        return None, float(obj)
+    raise TypeError(f"can not encode {type(obj).__name__}")
+
+
+def restore_defaultdict(value):
+    factory, items = value
+    return defaultdict(DEFAULT_FACTORIES[factory] if factory is not None else None, items)
+
+
+RESTORERS = {
+    "datetime": datetime.datetime.fromisoformat,
+    "date": datetime.date.fromisoformat,
+    "timedelta": lambda v: datetime.timedelta(seconds=v),
+    "tuple": tuple,
+    "set": set,
+    "defaultdict": restore_defaultdict,
+    "map": dict,
+    "PodMetric": lambda v: PodMetric(*v),
+    "NodeMetric": lambda v: NodeMetric(*v),
+}
+
+
+def msgpack_default(obj):
+    tag, value = reduce(obj, str_keys=False)
+    if tag is None:
+        return value
+    return msgpack.ExtType(EXT_CODES[tag], msgpack_dumps(value))
+
+
+def msgpack_ext_hook(code, data):
+    if code not in TAGS:
+        return msgpack.ExtType(code, data)
+    return RESTORERS[TAGS[code]](msgpack_loads(data))
+
+
+def msgpack_dumps(obj):
+    # strict types send tuples, namedtuples and dict subclasses to the default hook instead of packing them
+    # as plain lists and maps, aware datetimes are packed as msgpack timestamps and read back in utc
+    return msgpack.packb(obj, default=msgpack_default, strict_types=True, use_bin_type=True, datetime=True)
+
+
+def msgpack_loads(data):
+    return msgpack.unpackb(data, ext_hook=msgpack_ext_hook, strict_map_key=False, raw=False, timestamp=3)
+
+
+def json_plain(obj):
+    """
+    Tagged json tree of obj, every non native value becomes {"__t": tag, "v": plain value}.
+    """
+    if obj is None or type(obj) in (str, int, float, bool):
+        return obj
+    tag, value = reduce(obj, str_keys=True)
+    if tag is None and isinstance(value, dict):
+        if "__t" in value:
+            tag, value = "map", [[k, v] for k, v in value.items()]
+        else:
+            return {k: json_plain(v) for k, v in value.items()}
+    if tag is None and isinstance(value, list):
+        return [json_plain(v) for v in value]
+    if tag is None:
+        return value
+    return {"__t": tag, "v": json_plain(value)}
+
+
+def json_hook(obj):
+    if "__t" in obj:
+        return RESTORERS[obj["__t"]](obj["v"])
+    return obj
+
+
+def dumps(obj, serializer=None, compression=None):
+    """
+    :param serializer: msgpack or json, [storage] serializer by default
+    :param compression: zstd, zlib or none, [storage] compression by default
+    """
+    serializer = serializer or config_obj.get("storage", "serializer", fallback="msgpack")
+    compression = compression or config_obj.get("storage", "compression", fallback="zstd")
+    if serializer == "msgpack" and msgpack is None:
+        serializer = "json"
+    if compression == "zstd" and zstandard is None:
+        compression = "zlib"
+    if serializer == "msgpack":
+        payload = msgpack_dumps(obj)
+    else:
+        payload = json.dumps(json_plain(obj), separators=(",", ":")).encode("utf-8")
+    if len(payload) < COMPRESS_MIN_SIZE:
+        compression = "none"
+    if compression == "zstd":
+        payload = zstandard.ZstdCompressor(level=3).compress(payload)
+    elif compression == "zlib":
+        payload = zlib.compress(payload, 6)
+    flags = SERIALIZERS[serializer] << 4 | COMPRESSIONS[compression]
+    return MAGIC + bytes([FORMAT_VERSION, flags]) + payload
+
+
+def loads(data):
+    """
+    >>> value = {"start": datetime.datetime(2021, 4, 9, 10, 0), ("ns", "pod"): {1, 2}}
+    >>> all(loads(dumps(value, s, c)) == value for s in SERIALIZERS for c in COMPRESSIONS)
+    True
+    """
+    if data[:2] != MAGIC or data[2] != FORMAT_VERSION:
+        raise ValueError("not a report encoded by this codec version")
+    serializer, compression = data[3] >> 4, data[3] & 0x0f
+    payload = data[4:]
+    if compression == COMPRESSIONS["zstd"]:
+        if zstandard is None:
+            raise ValueError("the value is zstd compressed but zstandard is not installed")
+        payload = zstandard.ZstdDecompressor().decompress(payload)
+    elif compression == COMPRESSIONS["zlib"]:
+        payload = zlib.decompress(payload)
+    if serializer == SERIALIZERS["msgpack"]:
+        if msgpack is None:
+            raise ValueError("the value is msgpack encoded but msgpack is not installed")
+        return msgpack_loads(payload)
+    return json.loads(payload, object_hook=json_hook)
@@ -2,12 +2,19 @@ import eventlet
 
 eventlet.monkey_patch()
 
-import pickle
-from flask import Flask, render_template, request, redirect, url_for, g, flash
+import datetime
+import functools
+import json
+import random
+from flask import Flask, render_template, request, redirect, url_for, g, flash, abort
 from flask_socketio import SocketIO, emit
 from flask_redis import FlaskRedis
-from utils import merge_pod, merge_node
-from main import check
+from werkzeug.http import is_resource_modified
+from main import check, busy
+from history import HistoryStore
+from storage import ReportStore, PROGRESS_CHANNEL, GLOBAL_SECTIONS
+from tables import TABLES
+from utils import config_obj
 from threading import Lock
 
 thread = None
@@ -18,67 +25,150 @@ app.config['SECRET_KEY'] = 'dshkwnds'
 app.config['REDIS_URL'] = 'redis://localhost:6379/0'
 socket_io = SocketIO(app, async_mode='eventlet')
 redis = FlaskRedis(app)
+store = ReportStore()
+history = HistoryStore()
 
 
-def listener(channels):
+def listener(*channels):
     pub_sub = redis.pubsub()
-    pub_sub.psubscribe(channels)
+    pub_sub.psubscribe(*channels)
     with app.test_request_context('/recheck'):
         for item in pub_sub.listen():
             msg = item['data']
             if isinstance(msg, bytes):
                 msg = item['data'].decode('utf-8')
-                emit("update", {'data': msg}, namespace="/work", broadcast=True)
+                if item['channel'].decode('utf-8') == PROGRESS_CHANNEL:
+                    emit("progress", json.loads(msg), namespace="/work", broadcast=True)
+                else:
+                    emit("update", {'data': msg}, namespace="/work", broadcast=True)
 
 
 @app.before_request
 def before_request():
-    if redis.get("report") is None and request.endpoint not in ('recheck', 'static'):
+    if request.endpoint == 'static':
+        return
+    g.index = store.load_index()
+    if g.index is None and request.endpoint not in ('recheck', 'partial', 'trends', 'history_api'):
         return redirect(url_for("recheck"))
-    elif redis.get("report"):
-        report = redis.get('report')
-        report_dict = pickle.loads(report)
-        g.data = report_dict
-        g.nav = [*g.data]
+    g.nav = g.index['nav'] if g.index is not None else []
+
+
+def cached_page(view):
+    """
+    Cache the page a view renders per report version and path, the cache is replaced with the report.
+    The ETag names the version so unchanged pages are answered with 304 without rendering or reading redis.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        etag = f"{g.index['version']}-{request.path}"
+        last_modified = datetime.datetime.utcfromtimestamp(int(g.index['saved_at']))
+        if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+            response = app.response_class(status=304)
+        else:
+            page = store.get_page(g.index, request.path)
+            if page is None:
+                page = view(*args, **kwargs)
+                store.set_page(g.index, request.path, page)
+            response = app.response_class(page, mimetype='text/html')
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        # browsers revalidate every time, the 304 makes it cheap
+        response.cache_control.no_cache = True
+        return response
+    return wrapper
+
+
+# rows of every resource rollup card on the cluster page
+ROLLUP_ROWS = 10
+# sections of a cluster the cluster page renders, the pod and node tables are loaded through the table api
+CLUSTER_PAGE_SECTIONS = ['etcd_status', 'apiserver_status', 'controller_status', 'scheduler_status',
+                         'coredns_status', 'dns_nslookup', 'cluster_quota', 'tenants_quota', 'partitions_quota',
+                         'resource_rollups', 'error', 'node_failures']
+
+
+def render_cluster(cid):
+    data = store.fetch(g.index, {cid: CLUSTER_PAGE_SECTIONS})
+    return render_template("index.html", nav=g.nav, data=data[cid], cid=cid,
+                           tables=g.index['tables'].get(cid, {}), rollup_rows=ROLLUP_ROWS)
 
 
 @app.route("/")
+@cached_page
 def index():
-    cid = 'compass-stack'
-    g.data[cid]['node_info'] = merge_node(g.data, cid)
-    g.data[cid]['pod_info'] = merge_pod(g.data, cid)
-    return render_template("index.html", nav=g.nav, data=g.data[cid])
+    return render_cluster('compass-stack')
 
 
 @app.route('/<cid>')
 def cluster(cid):
-    g.data[cid]['node_info'] = merge_node(g.data, cid)
-    g.data[cid]['pod_info'] = merge_pod(g.data, cid)
-    return render_template("index.html", nav=g.nav, data=g.data[cid])
+    # only the clusters of the report have a page, other paths are not rendered nor cached
+    if cid not in g.index['nav'] or cid in GLOBAL_SECTIONS:
+        abort(404)
+    return cluster_page(cid)
+
+
+@cached_page
+def cluster_page(cid):
+    return render_cluster(cid)
+
+
+@app.route('/api/<cid>/<table>')
+def table(cid, table):
+    """
+    Pod or node table of a cluster in the DataTables server-side processing protocol.
+    """
+    if table not in TABLES:
+        abort(404)
+    args = request.args
+    column = min(max(args.get('order[0][column]', 0, type=int), 0), TABLES[table][1] - 1)
+    total, filtered, rows = store.query_table(g.index, cid, table, start=max(args.get('start', 0, type=int), 0),
+                                              length=args.get('length', 10, type=int), column=column,
+                                              descending=args.get('order[0][dir]') == 'desc',
+                                              search=args.get('search[value]', ''))
+    result = {'draw': args.get('draw', 0, type=int), 'recordsTotal': total, 'recordsFiltered': filtered,
+              'data': rows}
+    return app.response_class(json.dumps(result, default=str), mimetype='application/json')
 
 
 @app.route("/license")
+@cached_page
 def license():
-    license = g.data['license']
+    license = store.fetch(g.index, {"": ["license"]})[""]['license']
     return render_template("license.html", nav=g.nav, license=license)
 
 
 @app.route("/volumes_status")
+@cached_page
 def volume():
-    volume = g.data['volumes_status']
+    volume = store.fetch(g.index, {"": ["volumes_status"]})[""]['volumes_status']
     return render_template("volume.html", nav=g.nav, volume=volume)
 
 
+@app.route('/trends')
+def trends():
+    return render_template("trends.html", nav=g.nav, metrics=history.metrics())
+
+
+@app.route('/api/history')
+def history_api():
+    args = request.args
+    rows = history.query(args.get('scope', ''), args.get('name', ''), args.get('start', type=int),
+                         args.get('end', type=int))
+    return app.response_class(json.dumps(rows), mimetype='application/json')
+
+
+@app.route('/partial')
+def partial():
+    report = store.load_partial()
+    return app.response_class(json.dumps(report, default=str), mimetype='application/json')
+
+
 @app.route('/recheck')
 def recheck():
-    if redis.get("report") is None:
-        nav = []
+    if g.index is None:
         message = "There is no report found in the database for the time being. It looks like this is the first run," \
                   " please click the Execute button"
         flash(message)
-    else:
-        nav = g.nav
-    return render_template('recheck.html', nav=nav)
+    return render_template('recheck.html', nav=g.nav)
 
 
 @socket_io.on('connect', namespace='/work')
@@ -89,17 +179,43 @@ def connect():
         emit("update", {"data": "Check thread is working ......"})
 
 
-@socket_io.on('start', namespace='/work')
-def start_work():
+def start_check(force_full=False, scheduled=False):
+    """
+    Start a check run unless one is still working, runs never overlap. A run is still working while the
+    workers of its timed out clusters are running.
+    """
     global thread
     with thread_lock:
-        if thread is None or thread.is_alive() is False:
-            emit("update", {"data": "starting worker"})
-            thread = socket_io.start_background_task(target=check)
-        elif thread.is_alive():
-            emit("update", {"data": "Check thread is working ......"})
+        if (thread is not None and thread.is_alive()) or busy():
+            return False
+        thread = socket_io.start_background_task(check, force_full, scheduled)
+        return True
+
+
+def scheduler():
+    """
+    Start a run every interval, each run only re-checks what expired so the report stays fresh without full
+    fleet spikes. A run still working when the next one is due is not interrupted.
+    """
+    interval = config_obj.getint('schedule', 'interval', fallback=60)
+    jitter = config_obj.getfloat('schedule', 'jitter', fallback=0.1)
+    while True:
+        socket_io.sleep(interval * (1 + random.uniform(0, jitter)))
+        if not start_check(scheduled=True):
+            redis.publish("message", "scheduled check skipped, the previous run is still working")
+
+
+@socket_io.on('start', namespace='/work')
+def start_work(message=None):
+    force_full = bool(message and message.get('full'))
+    if start_check(force_full):
+        emit("update", {"data": "starting full worker" if force_full else "starting worker"})
+    else:
+        emit("update", {"data": "Check thread is working ......"})
 
 
 if __name__ == "__main__":
-    socket_io.start_background_task(listener, "message", )
+    socket_io.start_background_task(listener, "message", PROGRESS_CHANNEL)
+    if config_obj.getboolean('schedule', 'enabled', fallback=False):
+        socket_io.start_background_task(scheduler)
     socket_io.run(app=app, host="0.0.0.0", port=5000, debug=True)
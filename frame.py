@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+columnar pod and container resources of a cluster in numpy arrays, the pod metrics and the namespace, node
+and status rollups are vectorized group-bys over them
+"""
+import numpy as np
+
+from utils import parse_resources, ONE_GIBI, ONE_MEBI
+
+# per container columns, cpu in cores and memory in bytes
+RESOURCES = ['cpu', 'memory', 'cpu_requests', 'cpu_limits', 'memory_requests', 'memory_limits']
+# pod columns the rollups group by
+GROUPS = ['ns', 'node', 'status']
+
+
+class ResourceFrame(object):
+    """
+    One row per container holding its usage, requests and limits and the index of its pod. Every pod has
+    a code per group, the names of the codes are in ``keys``.
+    """
+
+    def __init__(self, pods, container_pod, columns, groups):
+        self.pods = pods
+        self.container_pod = container_pod
+        self.columns = columns
+        self.codes = dict()
+        self.keys = dict()
+        for group, values in groups.items():
+            self.keys[group], self.codes[group] = np.unique(np.array(values, dtype=str), return_inverse=True)
+
+    @classmethod
+    def from_pods(cls, pods, usage_by_pod):
+        """
+        :param pods: pod dicts as the snapshot pages hold them
+        :param usage_by_pod: {(namespace, pod): {container: (cpu, memory)}} from the metrics api
+        """
+        names = list()
+        groups = {group: list() for group in GROUPS}
+        container_pod = list()
+        usages = list()
+        quantities = {column: list() for column in RESOURCES[2:]}
+        for pod in pods:
+            ns, name = pod['metadata']['namespace'], pod['metadata']['name']
+            usage = usage_by_pod.get((ns, name)) or {}
+            index = len(names)
+            names.append((ns, name))
+            groups['ns'].append(ns)
+            groups['node'].append(pod['spec'].get('node_name') or '')
+            groups['status'].append(pod['status']['phase'] or '')
+            for container in pod['spec']['containers']:
+                resources = container.get('resources') or {}
+                limits = resources.get('limits') or {}
+                requests = resources.get('requests') or {}
+                container_pod.append(index)
+                usages.append(usage.get(container['name'], (0, 0)))
+                quantities['cpu_requests'].append(requests.get('cpu'))
+                quantities['cpu_limits'].append(limits.get('cpu'))
+                quantities['memory_requests'].append(requests.get('memory'))
+                quantities['memory_limits'].append(limits.get('memory'))
+        usages = np.array(usages, dtype=np.float64).reshape(-1, 2)
+        columns = {'cpu': usages[:, 0], 'memory': usages[:, 1]}
+        columns.update({column: parse_resources(values) for column, values in quantities.items()})
+        return cls(names, np.array(container_pod, dtype=np.int64), columns, groups)
+
+    def pod_totals(self):
+        """
+        Every column summed per pod.
+        """
+        return {column: np.bincount(self.container_pod, weights=values, minlength=len(self.pods))
+                for column, values in self.columns.items()}
+
+    def rollup(self, group, totals=None):
+        """
+        Pods, containers and the summed columns per value of a group, cpu in cores and memory in GiB.
+
+        :param group: one of GROUPS
+        :return: {value: {'pods': n, 'containers': n, 'cpu': cores, 'memory': GiB, ...}}
+        """
+        totals = totals or self.pod_totals()
+        codes, keys = self.codes[group], self.keys[group]
+        result = {'pods': np.bincount(codes, minlength=len(keys)),
+                  'containers': np.bincount(codes[self.container_pod], minlength=len(keys))}
+        for column, values in totals.items():
+            sums = np.bincount(codes, weights=values, minlength=len(keys))
+            result[column] = np.round(sums / ONE_GIBI, 2) if column.startswith('memory') else np.round(sums, 3)
+        return {str(key): {column: values[i].item() for column, values in result.items()}
+                for i, key in enumerate(keys)}
+
+    def rollups(self):
+        totals = self.pod_totals()
+        return {group: self.rollup(group, totals) for group in GROUPS}
+
+    def pod_metrics(self, metric):
+        """
+        One metric per pod in the units of PodMetric, memory usage in MiB and requests/limits in GiB,
+        sorted by memory usage.
+        """
+        totals = self.pod_totals()
+        cpu = np.round(totals['cpu'], 3)
+        memory = np.round(totals['memory'] / ONE_MEBI)
+        resources = {column: np.round(totals[column] / ONE_GIBI, 1) if column.startswith('memory') else
+                     np.round(totals[column], 3) for column in RESOURCES[2:]}
+        status = self.keys['status'][self.codes['status']]
+        order = np.argsort(-memory, kind='stable')
+        return [metric(ns=self.pods[i][0], pod=self.pods[i][1], status=str(status[i]), cpu=cpu[i].item(),
+                       memory=int(memory[i]), **{column: values[i].item() for column, values in resources.items()})
+                for i in order]
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+history of the numeric metrics of every check run in a local sqlite file, so trends are read without
+loading old reports
+
+every sample is one (metric, resolution, ts) row holding the average, min and max of the count raw samples
+it summarizes. Raw samples older than [history] raw_days are rolled up to hourly averages, hourly ones older
+than hourly_days to daily averages, daily ones older than daily_days are dropped.
+"""
+import re
+import sqlite3
+import threading
+import time
+
+from log import logger
+from utils import config_obj
+
+RAW, HOURLY, DAILY = 0, 3600, 86400
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metrics (
+    id INTEGER PRIMARY KEY,
+    scope TEXT NOT NULL,
+    name TEXT NOT NULL,
+    UNIQUE (scope, name)
+);
+CREATE TABLE IF NOT EXISTS samples (
+    metric_id INTEGER NOT NULL,
+    resolution INTEGER NOT NULL,
+    ts INTEGER NOT NULL,
+    value REAL NOT NULL,
+    min REAL NOT NULL,
+    max REAL NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (metric_id, resolution, ts)
+) WITHOUT ROWID;
+"""
+
+
+def number(value):
+    """
+    Float of a numeric check value, the quota checks format theirs like "12.50Gi".
+
+    >>> number("12.50Gi"), number(3), number("n/a"), number(None)
+    (12.5, 3.0, None, None)
+    """
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = re.fullmatch(r"\s*(-?[\d.]+)\s*(Gi)?\s*", str(value))
+    return float(match.group(1)) if match else None
+
+
+def ratio(data):
+    used, total = number(data.get("used")), number(data.get("total", data.get("quota")))
+    return used / total if used is not None and total else None
+
+
+def quota_metrics(prefix, quota):
+    for resource, entry in quota.items():
+        if isinstance(entry, dict) and "data" in entry:
+            yield f"{prefix}/{resource}", ratio(entry["data"])
+        elif isinstance(entry, dict):
+            yield from quota_metrics(f"{prefix}/{resource}", entry)
+
+
+def node_metrics(ip, node):
+    """
+    Name, probe and value of the metrics of a node.
+    """
+    load = str(node.get("nodeload", {}).get("loadaverage", "")).split(",")[0]
+    yield f"node/{ip}/load1", "load", number(load)
+    yield f"node/{ip}/contrack", "contrack", node.get("contrack", {}).get("contrack_percentage")
+    yield f"node/{ip}/openfile", "openfile", node.get("openfile", {}).get("openfile_percentage")
+    yield f"node/{ip}/pid", "pid", node.get("pid", {}).get("pid_percentage")
+    yield f"node/{ip}/docker_fd", "docker", node.get("docker", {}).get("dockerFDPercentage")
+
+
+def extract_metrics(checkout, checked=None):
+    """
+    Numeric metrics of a report as (scope, name, value), the scope is the cluster or empty for platform checks.
+
+    :param checked: freshness keys (scope, check) of the results checked in this run, the metrics of the
+        results reused from an earlier run are left out; every metric when None
+    """
+    # (scope, name, value, freshness key of the check the value comes from)
+    license_data = checkout.get("license", {}).get("data", {})
+    metrics = [("", f"license/{key}", number(license_data.get(key)), ("", "license"))
+               for key in ("remain_days", "remain_logical_cpu", "remain_physical_cpu")]
+    for cluster, data in checkout.items():
+        if not isinstance(data, dict) or "start_time" not in data:
+            continue
+        for cidr in ("pod_cidr", "svc_cidr"):
+            if cidr in data:
+                metrics.append((cluster, f"{cidr}/usage", ratio(data[cidr]["data"]), (cluster, "cidr")))
+        for phase, pods in data.get("pods_status", {}).items():
+            metrics.append((cluster, f"pods/{phase}", number(pods["data"]), (cluster, "pod_status")))
+        metrics.extend((cluster, name, value, (cluster, "clusters_quotas"))
+                       for name, value in quota_metrics("cluster_quota", data.get("cluster_quota", {})))
+        for key, check in (("tenants_quota", "tenants_quotas"), ("partitions_quota", "partitions_quotas")):
+            metrics.extend((cluster, name, value, (cluster, check))
+                           for name, value in quota_metrics(key, data.get(key) or {}))
+        for ip, node in data.get("node_info", {}).items():
+            metrics.extend((cluster, name, number(value), (ip, f"node_{probe}"))
+                           for name, probe, value in node_metrics(ip, node))
+    return [(scope, name, value) for scope, name, value, source in metrics
+            if value is not None and (checked is None or source in checked)]
+
+
+class HistoryStore:
+    def __init__(self, path=None):
+        self.path = path or config_obj.get("history", "path", fallback="./history.db")
+        self.raw_days = config_obj.getint("history", "raw_days", fallback=7)
+        self.hourly_days = config_obj.getint("history", "hourly_days", fallback=90)
+        self.daily_days = config_obj.getint("history", "daily_days", fallback=730)
+        self.max_points = config_obj.getint("history", "max_points", fallback=500)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def metric_ids(self, metrics):
+        known = {(scope, name): metric_id for metric_id, scope, name in self.conn.execute(
+            "SELECT id, scope, name FROM metrics")}
+        new = {(scope, name) for scope, name, _ in metrics} - known.keys()
+        self.conn.executemany("INSERT INTO metrics (scope, name) VALUES (?, ?)", new)
+        if new:
+            known.update({(scope, name): metric_id for metric_id, scope, name in self.conn.execute(
+                "SELECT id, scope, name FROM metrics")})
+        return known
+
+    def record(self, checkout, ts=None, checked=None):
+        """
+        Store the metrics of a report as raw samples, then roll up the expired ones.
+
+        :param checked: see extract_metrics, an incremental run only records what it re-checked
+        """
+        ts = int(ts or time.time())
+        metrics = extract_metrics(checkout, checked)
+        with self.lock, self.conn:
+            ids = self.metric_ids(metrics)
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO samples VALUES (?, ?, ?, ?, ?, ?, 1)",
+                [(ids[(scope, name)], RAW, ts, value, value, value) for scope, name, value in metrics])
+            self.downsample(ts)
+        logger.info(f"{len(metrics)} metrics recorded to history")
+
+    def rollup(self, source, target, before):
+        """
+        Replace the source samples older than before by target buckets, a bucket rolled up by an earlier call
+        is merged with the new samples falling in it.
+        """
+        params = {"source": source, "target": target, "before": before}
+        self.conn.execute(
+            "INSERT OR REPLACE INTO samples "
+            "SELECT metric_id, :target, ts / :target * :target AS bucket, sum(value * count) / sum(count), "
+            "min(min), max(max), sum(count) FROM samples "
+            "WHERE (resolution = :source AND ts < :before) OR (resolution = :target AND ts >= "
+            "(SELECT min(ts) FROM samples WHERE resolution = :source AND ts < :before) / :target * :target) "
+            "GROUP BY metric_id, bucket", params)
+        self.conn.execute("DELETE FROM samples WHERE resolution = :source AND ts < :before", params)
+
+    def downsample(self, now):
+        self.rollup(RAW, HOURLY, now - self.raw_days * DAILY)
+        self.rollup(HOURLY, DAILY, now - self.hourly_days * DAILY)
+        self.conn.execute("DELETE FROM samples WHERE resolution = ? AND ts < ?",
+                          (DAILY, now - self.daily_days * DAILY))
+
+    def metrics(self, scope=None):
+        query = "SELECT scope, name FROM metrics"
+        with self.lock:
+            if scope is not None:
+                return [name for _, name in self.conn.execute(query + " WHERE scope = ? ORDER BY name", (scope,))]
+            return [list(row) for row in self.conn.execute(query + " ORDER BY scope, name")]
+
+    def query(self, scope, name, start=None, end=None):
+        """
+        Samples of a metric in [start, end) averaged into at most max_points buckets, old ranges come from
+        the rolled up samples.
+
+        :return: [(ts, value, min, max), ...] ordered by ts
+        """
+        end = int(end or time.time())
+        start = int(start or end - self.raw_days * DAILY)
+        bucket = max((end - start) // self.max_points, 1)
+        with self.lock:
+            return self.conn.execute(
+                "SELECT ts / ? * ? AS bucket, sum(value * count) / sum(count), min(min), max(max) FROM samples "
+                "JOIN metrics ON metrics.id = samples.metric_id "
+                "WHERE scope = ? AND name = ? AND ts >= ? AND ts < ? GROUP BY bucket ORDER BY bucket",
+                (bucket, bucket, scope, name, start, end)).fetchall()
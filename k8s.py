@@ -1,11 +1,12 @@
 import collections
+from concurrent.futures import ThreadPoolExecutor, wait
 import urllib3
 
-import jsonpath
-
 from clusters import Cluster
+from frame import ResourceFrame
 from log import logger
-from utils import parse_resource, ONE_GIBI, ONE_MEBI
+from paths import compile_path
+from utils import config_obj, json_loads, parse_resource, ONE_GIBI
 
 urllib3.disable_warnings()
 
@@ -25,86 +26,101 @@ node_metric_fields = [
     'node', 'cpu', 'memory'
 ]
 NodeMetric = collections.namedtuple('NodeMetric', node_metric_fields)
+NODE_NAMES = compile_path('$[*].metadata.name')
 
 
 class K8sClient(Cluster):
-    def __init__(self, kube_conf):
-        super(K8sClient, self).__init__(kube_conf)
-        self.node_list = jsonpath.jsonpath(super(K8sClient, self).get_node(), '$.items[*].metadata.name')
+    def __init__(self, kube_conf, snapshot=None):
+        super(K8sClient, self).__init__(kube_conf, snapshot)
+        self.node_list = list()
+        for page in self.snapshot.pages('node'):
+            self.node_list.extend(NODE_NAMES(page))
 
     def get_metric(self):
-        api_instance = self.core_v1_api
-        pods = api_instance.list_pod_for_all_namespaces().items
-        node_usages = [self.top_node(node) for node in self.node_list]
-        pods_usages = sorted([self.top_pod(pod) for pod in pods], key=lambda x: x.memory, reverse=True)
-        return {"nodes": node_usages, "pods": pods_usages}
+        node_usages = self.top_nodes()
+        usage_by_pod, metrics_bytes = self.top_pods() or ({}, 0)
+        frame = ResourceFrame.from_pods((pod for page in self.snapshot.pages('pods') for pod in page), usage_by_pod)
+        pods_usages = frame.pod_metrics(PodMetric)
+        # top_pod used to list every pod metric once per pod, the join needs a single list call
+        saved = {"api_calls": max(len(pods_usages) - 1, 0), "bytes": max(len(pods_usages) - 1, 0) * metrics_bytes}
+        logger.info(f"pod metrics joined in one list call, saved {saved['api_calls']} api calls "
+                    f"and {saved['bytes']} bytes")
+        return {"nodes": node_usages, "pods": pods_usages, "saved": saved, "rollups": frame.rollups()}
 
-    @logger.catch
-    def top_node(self, node):
+    def top_nodes(self):
+        """
+        Fetch every node usage with a single list call, nodes missing from the list are fetched
+        one by one concurrently and dropped when they do not answer before metric_timeout. The fetches run
+        in waves of at most 20, each with its share of metric_timeout, so no fetch outlives metric_timeout.
+        """
         custom = self.custom_api
-        data = custom.get_cluster_custom_object("metrics.k8s.io", "v1beta1", "nodes", node)
+        timeout = config_obj.getint('kubernetes', 'metric_timeout', fallback=30)
+        node_usages = dict()
+        try:
+            data = custom.list_cluster_custom_object("metrics.k8s.io", "v1beta1", "nodes", _request_timeout=timeout)
+            for item in data['items']:
+                node_usages[item['metadata']['name']] = self.node_metric(item)
+        except Exception as err:
+            logger.error(f"list node metrics failed, fall back to per node fetching: {err}")
+        missing = [node for node in self.node_list if node not in node_usages]
+        if missing:
+            logger.info(f"fetch metrics of {len(missing)} nodes missing from the list")
+            workers = min(len(missing), 20)
+            waves = -(-len(missing) // workers)
+            executor = ThreadPoolExecutor(workers)
+            futures = {executor.submit(self.top_node, node, timeout / waves): node for node in missing}
+            done, not_done = wait(futures, timeout=timeout)
+            for future in done:
+                if future.result() is not None:
+                    node_usages[futures[future]] = future.result()
+            for future in not_done:
+                logger.error(f"fetch node {futures[future]} metrics timed out after {timeout}s")
+            executor.shutdown(wait=False)
+        return [node_usages[node] for node in self.node_list if node in node_usages]
+
+    @staticmethod
+    def node_metric(data):
         node = data['metadata']['name']
         cpu = parse_resource(data['usage']['cpu'])
         memory = parse_resource(data['usage']['memory'])
         return NodeMetric(node=node, cpu=cpu, memory=memory / ONE_GIBI)
 
     @logger.catch
-    def top_pods(self):
+    def top_node(self, node, timeout=None):
         custom = self.custom_api
-        data = custom.list_cluster_custom_object("metrics.k8s.io", "v1beta1", "pods")
-        usage_by_pod = collections.defaultdict(list)
-        for pod_data in data['items']:
-            pod_name = pod_data['metadata']['name']
-            for container_data in pod_data['containers']:
-                usage_by_pod[pod_name].append(
-                    {
-                        'pod': container_data['name'],
-                        'cpu': parse_resource(container_data['usage']['cpu']),
-                        'memory': parse_resource(container_data['usage']['memory']) / ONE_MEBI,
-                    }
-                )
-        return usage_by_pod
-
-    @staticmethod
-    def aggregate_container_resource(pod):
-        values = {
-            'memory_limits': 0,
-            'cpu_limits': 0,
-            'memory_requests': 0,
-            'cpu_requests': 0,
-        }
-        for container in pod.spec.containers:
-            limits = getattr(container.resources, 'limits', None)
-            if limits:
-                values['memory_limits'] += round(parse_resource(limits.get('memory')) / ONE_GIBI, 1)
-                values['cpu_limits'] += parse_resource(limits.get('cpu'))
-            requests = getattr(container.resources, 'requests', None)
-            if requests:
-                values['memory_requests'] += round(parse_resource(requests.get('memory')) / ONE_GIBI, 1)
-                values['cpu_requests'] += parse_resource(requests.get('cpu'))
-        return values
+        data = custom.get_cluster_custom_object("metrics.k8s.io", "v1beta1", "nodes", node,
+                                                _request_timeout=timeout)
+        return self.node_metric(data)
 
     @logger.catch
-    def top_pod(self, pod):
-        ns = pod.metadata.namespace
-        status = pod.status.phase
-        data = self.top_pods().get(pod.metadata.name) or []
-        cpu = round(sum(pod_data['cpu'] for pod_data in data), 3)
-        memory = round(sum(pod_data['memory'] for pod_data in data))
-        return PodMetric(ns=ns, pod=pod.metadata.name, status=status, cpu=cpu, memory=memory,
-                         **self.aggregate_container_resource(pod))
+    def top_pods(self):
+        """
+        List every pod metric once and index the container usages by (namespace, pod).
+
+        :return: the index {(namespace, pod): {container: (cpu cores, memory bytes)}} and the size in bytes
+                 of the metrics response
+        """
+        custom = self.custom_api
+        resp = custom.list_cluster_custom_object("metrics.k8s.io", "v1beta1", "pods", _preload_content=False)
+        raw = resp.data
+        data = json_loads(raw)
+        usage_by_pod = dict()
+        for pod_data in data['items']:
+            key = (pod_data['metadata']['namespace'], pod_data['metadata']['name'])
+            usage_by_pod[key] = {container_data['name']: (parse_resource(container_data['usage']['cpu']),
+                                                          parse_resource(container_data['usage']['memory']))
+                                 for container_data in pod_data['containers']}
+        return usage_by_pod, len(raw)
 
     def get_job(self):
-        api_instance = self.batch_v1_api
-        jobs = api_instance.list_job_for_all_namespaces()
         jobs_status = []
-        for i in jobs.items:
-            name = i.metadata.name
-            ns = i.metadata.namespace
-            start = i.status.start_time
-            if i.status.succeeded == 1:
+        for i in (job for page in self.snapshot.pages('jobs') for job in page):
+            name = i['metadata']['name']
+            ns = i['metadata']['namespace']
+            start = i['status']['start_time']
+            if i['status']['succeeded'] == 1:
                 status = "success"
-            elif i.status.failed == 1:
+            elif i['status']['failed'] == 1:
                 status = "failed"
             else:
                 status = "active"
@@ -121,38 +137,34 @@ class K8sClient(Cluster):
         return {"desc": "component", "result": component_list}
 
     def get_node(self):
-        api_instance = self.core_v1_api
-        nodes = api_instance.list_node()
         result = []
-        for i in nodes.items:
+        for i in (node for page in self.snapshot.pages('node') for node in page):
             node = dict()
-            for x in i.status.addresses:
-                node[x.type] = x.address
-            for s in i.status.conditions:
-                if s.type == "Ready":
-                    node['status'] = "Ready" if s.status else "NotReady"
-            node['kernel'] = i.status.node_info.kernel_version
-            node['container_runtime'] = i.status.node_info.container_runtime_version
-            node['cpu'] = i.status.capacity['cpu']
-            node['memory'] = round(parse_resource(i.status.capacity['memory']) / ONE_GIBI)
+            for x in i['status']['addresses']:
+                node[x['type']] = x['address']
+            for s in i['status']['conditions']:
+                if s['type'] == "Ready":
+                    node['status'] = "Ready" if s['status'] else "NotReady"
+            node['kernel'] = i['status']['node_info']['kernel_version']
+            node['container_runtime'] = i['status']['node_info']['container_runtime_version']
+            node['cpu'] = i['status']['capacity']['cpu']
+            node['memory'] = round(parse_resource(i['status']['capacity']['memory']) / ONE_GIBI)
             result.append(node)
         return {"desc": "node", "result": result}
 
     def get_pod(self):
-        api_instance = self.core_v1_api
-        pods = api_instance.list_pod_for_all_namespaces()
         result = []
-        for i in pods.items:
+        for i in (pod for page in self.snapshot.pages('pods') for pod in page):
             pod = dict()
-            pod['name'] = i.metadata.name
-            pod['ns'] = i.metadata.namespace
-            pod['status'] = i.status.phase
-            if i.status.container_statuses is not None:
-                pod['restart'] = max([x.restart_count for x in i.status.container_statuses])
+            pod['name'] = i['metadata']['name']
+            pod['ns'] = i['metadata']['namespace']
+            pod['status'] = i['status']['phase']
+            if i['status']['container_statuses'] is not None:
+                pod['restart'] = max([x['restart_count'] for x in i['status']['container_statuses']])
             else:
                 pod['restart'] = None
-            pod['start_time'] = i.status.start_time
-            pod['ip'] = i.status.pod_ip
-            pod['host'] = i.status.host_ip
+            pod['start_time'] = i['status']['start_time']
+            pod['ip'] = i['status']['pod_ip']
+            pod['host'] = i['status']['host_ip']
             result.append(pod)
         return {"desc": "pod", "result": result}
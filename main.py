@@ -1,38 +1,104 @@
 from k8s import K8sClient
+import copy
 import datetime
+from concurrent.futures import ThreadPoolExecutor, wait
 from check import CheckGlobal, CheckK8s
 from pathlib import Path
-import pickle
 from log import logger
-from redis import Redis
+from history import HistoryStore
+from storage import ReportStore
+from utils import config_obj, merge_views
 
-@logger.catch
-def check():
-    control_k8s = CheckGlobal()
-    busybox_images = control_k8s.load_busybox_image()
-    control_k8s.start_check()
-    check_out = control_k8s.checkout
-    k8s_conf_list = control_k8s.k8s_conf_list
-    for conf in k8s_conf_list:
-        cluster_name = Path(conf).name
-        k8s_obj = CheckK8s(conf, check_out)
-        if k8s_obj.create_check_pod(busybox_images):
+
+def check_cluster(conf, check_out, busybox_images, store, freshness):
+    cluster_name = Path(conf).name
+    check_out[cluster_name]['start_time'] = datetime.datetime.now()
+    check_out[cluster_name].pop('error', None)
+    try:
+        k8s_obj = CheckK8s(conf, check_out, store, freshness)
+        if k8s_obj.need_check_pod():
+            try:
+                k8s_obj.start_check(k8s_obj.create_check_pod(busybox_images))
+            finally:
+                k8s_obj.release_check_pod()
+        else:
             k8s_obj.start_check()
-        k8s_obj.del_check_pod()
-        k8s = K8sClient(conf)
+        if freshness.fresh(cluster_name, 'context'):
+            return
+        k8s = K8sClient(conf, k8s_obj.snapshot)
         now = datetime.datetime.now()
         context = {}
         for i in ["node", "pod", "job", "metric"]:
             context_method = getattr(k8s, "get_{}".format(i))
             context[i] = context_method()
             context['now'] = now
+        context['fetched_at'] = k8s.snapshot.fetched_at
         check_out[cluster_name]['context'] = context
-    r = Redis("localhost")
-    dump = pickle.dumps(check_out)
-    r.set("report", dump)
-    logger.info("report save to redis has been completed")
-    return True
+        freshness.mark(cluster_name, 'context', freshness.ttl('context', 60))
+    except Exception as err:
+        logger.exception(f"check cluster {cluster_name} failed: {err}")
+        check_out[cluster_name]['error'] = str(err)
+    finally:
+        check_out[cluster_name]['end_time'] = datetime.datetime.now()
+        logger.info(f"cluster {cluster_name} check finished in "
+                    f"{check_out[cluster_name]['end_time'] - check_out[cluster_name]['start_time']}")
+        store.publish('cluster', cluster_name, cluster_name, check_out[cluster_name])
+
 
+# workers of timed out clusters that are still running, they keep writing into their run's checkout,
+# freshness and check pod, so no new run starts before they finished
+stragglers = set()
 
 
+def busy():
+    """
+    True while a worker of a timed out cluster from an earlier run is still running.
+    """
+    stragglers.difference_update([future for future in list(stragglers) if future.done()])
+    return bool(stragglers)
 
+
+@logger.catch
+def check(force_full=False, scheduled=False):
+    """
+    Re-check the results whose ttl expired on top of the previous report, force_full re-checks everything.
+    A scheduled run checks at most [schedule] max_nodes nodes.
+    """
+    if busy():
+        logger.error(f"{len(stragglers)} timed out cluster checks of the previous run are still running, skip")
+        return False
+    store = ReportStore()
+    store.start_run()
+    previous = None if force_full else store.load()
+    freshness = store.load_freshness(force=previous is None)
+    control_k8s = CheckGlobal(store, freshness, previous, scheduled)
+    busybox_images = control_k8s.load_busybox_image()
+    control_k8s.start_check()
+    check_out = control_k8s.checkout
+    k8s_conf_list = control_k8s.k8s_conf_list
+    workers = config_obj.getint('kubernetes', 'cluster_workers', fallback=4)
+    timeout = config_obj.getint('kubernetes', 'cluster_timeout', fallback=1800)
+    # results of every cluster before its worker starts: the previous report and the CheckGlobal sections
+    prior = {Path(conf).name: dict(check_out[Path(conf).name]) for conf in k8s_conf_list}
+    prior_expires = {cluster_name: freshness.scope_expires(cluster_name) for cluster_name in prior}
+    executor = ThreadPoolExecutor(max(min(workers, len(k8s_conf_list)), 1))
+    futures = {executor.submit(check_cluster, conf, check_out, busybox_images, store, freshness): conf
+               for conf in k8s_conf_list}
+    done, not_done = wait(futures, timeout=timeout)
+    # the workers of timed out clusters keep writing into check_out and freshness, a timed out cluster is
+    # reported with the results and expiry times it had before its worker started
+    report = copy.copy(check_out)
+    restore = dict()
+    for future in not_done:
+        cluster_name = Path(futures[future]).name
+        logger.error(f"check cluster {cluster_name} did not finish in {timeout}s, skip it")
+        report[cluster_name] = dict(prior[cluster_name], error=f"timeout after {timeout}s")
+        restore[cluster_name] = prior_expires[cluster_name]
+    stragglers.update(not_done)
+    executor.shutdown(wait=False)
+    run_freshness = freshness.snapshot(restore)
+    merge_views(report)
+    store.save(report, run_freshness)
+    with HistoryStore() as history:
+        history.record(report, checked=run_freshness.marked)
+    return True
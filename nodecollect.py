@@ -9,12 +9,83 @@
 
 # from multiprocessing import Pool, Queue
 from utils import RemoteClientCompass, config_obj
+from log import logger
 from collections import defaultdict
+import asyncio
+import base64
+import json
+import math
 import re
+import statistics
+import time
 from concurrent.futures import ThreadPoolExecutor
+from threading import Condition, Lock
+
+try:
+    import asyncssh
+except ImportError:
+    asyncssh = None
 
 # q = Queue()
-AllResult = list()
+
+DOCKER_ACTIVE_CMD = r'''systemctl is-active docker'''
+DOCKER_FD_CMD = r'''dockerPid=$(ps aux |grep /bin/dockerd|grep -v grep |awk '{print $2}');cat /proc/$dockerPid/limits |grep files |awk '{print $(NF-1)}';ls -lR  /proc/$dockerPid/fd |grep '^l'|wc -l'''
+LOAD_CMD = r'''cpuCount=$(lscpu |grep 'CPU(s):'|grep -v -i numa|awk '{print $NF}');maxCpuLoad=$(($cpuCount*2));loadAverage=$(uptime |awk -F ':' '{print  $NF}');echo $loadAverage|awk  -F',| +' -v load=$maxCpuLoad '{if($1<load && $2<load && $3<load){print "OK"}else{print "highLoad"}}';echo $loadAverage  '''
+CONTRACK_CMD = r'''cat /proc/sys/net/nf_conntrack_max;cat /proc/sys/net/netfilter/nf_conntrack_count'''
+OPENFILE_CMD = r'''cat /proc/sys/fs/file-nr'''
+PID_CMD = r'''ls -ld  /proc/[0-9]* |wc -l;cat /proc/sys/kernel/pid_max'''
+DNS_CMD = "which host || yum -y -q  install  bind-utils;host {}"
+DISKIO_CMD = r'''iostat -x 2  5'''
+DISKUSAGE_CMD = r'''df -h|grep -v -E "token|secret|overlay2|containers|tmpfs|kubernetes.io|Filesystem" '''
+NIC_LIST_CMD = r'''ip r|grep -v br_bond|grep -E -o "eth[0-9]*|bond[0-9]*|ens[0-9]*"|sort -u'''
+NIC_SAR_CMD = r'''sar -n DEV 1 8'''
+ZPROCESS_CMD = r'''ps -A -ostat,ppid,pid,cmd | grep -e '^[Zz]' '''
+NTP_SYNC_CMD = r'''timedatectl  status|grep synchronized|awk -F':| +' '{print $NF}' '''
+NTP_OFFSET_CMD = r'''chronyc  sources|grep -E "^\^\*" |cut  -d[ -f 1|awk '{print $NF}' '''
+CONTAINERD_CMD = r'''pgrep -fl containerd|grep -Ev "shim|dockerd|bash"  '''
+KUBELET_ACTIVE_CMD = r'''systemctl  is-active kubelet '''
+KUBELET_HEALTH_CMD = r'''curl --connect-timeout 5 -sk  127.0.0.1:10248/healthz'''
+KUBEPROXY_HEALTH_CMD = r'''curl --connect-timeout 5 -sk 127.0.0.1:10249/healthz'''
+# samplers taking seconds, the batched probe runs them in the background
+SAMPLER_CMDS = (DISKIO_CMD, NIC_SAR_CMD)
+PROBES = ["docker", "load", "contrack", "openfile", "pid", "dns", "diskIO", "diskUsage", "nic", "zprocess", "ntp",
+          "containerd", "kubelet", "kubeproxy"]
+# commands every probe may run, dns runs DNS_CMD once per external domain
+PROBE_COMMANDS = {
+    "docker": [DOCKER_ACTIVE_CMD, DOCKER_FD_CMD],
+    "load": [LOAD_CMD],
+    "contrack": [CONTRACK_CMD],
+    "openfile": [OPENFILE_CMD],
+    "pid": [PID_CMD],
+    "dns": [],
+    "diskIO": [DISKIO_CMD],
+    "diskUsage": [DISKUSAGE_CMD],
+    "nic": [NIC_LIST_CMD, NIC_SAR_CMD],
+    "zprocess": [ZPROCESS_CMD],
+    "ntp": [NTP_SYNC_CMD, NTP_OFFSET_CMD],
+    "containerd": [CONTAINERD_CMD],
+    "kubelet": [KUBELET_ACTIVE_CMD, KUBELET_HEALTH_CMD],
+    "kubeproxy": [KUBEPROXY_HEALTH_CMD],
+}
+# seconds a probe result stays fresh for incremental rechecks, overridden by node_<probe> in [ttl]
+PROBE_TTL = {"docker": 300, "load": 60, "contrack": 60, "openfile": 300, "pid": 300, "dns": 600, "diskIO": 300,
+             "diskUsage": 600, "nic": 300, "zprocess": 300, "ntp": 600, "containerd": 300, "kubelet": 120,
+             "kubeproxy": 120}
+# every probe command is passed base64 encoded, the output is one json line:
+# {"<id>": {"rc": <exit status>, "out": "<base64 stdout>", "err": "<base64 stderr>"}, ...}
+BATCH_SCRIPT = r'''d=$(mktemp -d)
+probe() {{ bash -c "$(echo "$2" | base64 -d)" >"$d/$1.out" 2>"$d/$1.err"; echo $? >"$d/$1.rc"; }}
+{probes}
+wait
+sep=''
+printf '{{'
+for i in {ids}; do
+  printf '%s"%s":{{"rc":%s,"out":"%s","err":"%s"}}' "$sep" "$i" "$(cat "$d/$i.rc")" "$(base64 -w0 "$d/$i.out")" "$(base64 -w0 "$d/$i.err")"
+  sep=','
+done
+printf '}}\n'
+rm -rf "$d"
+'''
 
 
 def strstrip(a: str) -> str:
@@ -22,8 +93,8 @@ def strstrip(a: str) -> str:
 
 
 class nodecheck(RemoteClientCompass):
-    def __init__(self, host, user, ssh_port, pwd, ssh_key):
-        super(nodecheck, self).__init__(host, user, ssh_port, pwd, ssh_key)
+    def __init__(self, host, user, ssh_port, pwd, ssh_key, pool=None):
+        super(nodecheck, self).__init__(host, user, ssh_port, pwd, ssh_key, pool)
         self.execute_commands = self.cmd
 
     def get_docker(self):
@@ -38,11 +109,11 @@ class nodecheck(RemoteClientCompass):
         }
         """
         docker_status = defaultdict(dict)
-        cmd = r'''systemctl is-active docker'''
+        cmd = DOCKER_ACTIVE_CMD
         isDockerActive = self.execute_commands(cmd)
         # if strstrip(isDockerActive[0])=="active":
         if isinstance(isDockerActive, list):
-            cmd = r'''dockerPid=$(ps aux |grep /bin/dockerd|grep -v grep |awk '{print $2}');cat /proc/$dockerPid/limits |grep files |awk '{print $(NF-1)}';ls -lR  /proc/$dockerPid/fd |grep '^l'|wc -l'''
+            cmd = DOCKER_FD_CMD
             dockerFD = self.execute_commands(cmd)
             maxDockerFD = strstrip(dockerFD[0])
             usedDockerFD = strstrip(dockerFD[1])
@@ -70,7 +141,7 @@ class nodecheck(RemoteClientCompass):
         }
         """
         nodeLoad = defaultdict(dict)
-        cmd = r'''cpuCount=$(lscpu |grep 'CPU(s):'|grep -v -i numa|awk '{print $NF}');maxCpuLoad=$(($cpuCount*2));loadAverage=$(uptime |awk -F ':' '{print  $NF}');echo $loadAverage|awk  -F',| +' -v load=$maxCpuLoad '{if($1<load && $2<load && $3<load){print "OK"}else{print "highLoad"}}';echo $loadAverage  '''
+        cmd = LOAD_CMD
         load = self.execute_commands(cmd)
         if strstrip(load[0]) == "OK":
             nodeLoad["nodeload"]["check_result"] = True
@@ -91,7 +162,7 @@ class nodecheck(RemoteClientCompass):
         }
         """
         contrack = defaultdict(dict)
-        cmd = r'''cat /proc/sys/net/nf_conntrack_max;cat /proc/sys/net/netfilter/nf_conntrack_count'''
+        cmd = CONTRACK_CMD
         response = self.execute_commands(cmd)
         contrack["contrack"]["contrack_max"] = strstrip(response[0])
         contrack["contrack"]["contrack_used"] = strstrip(response[1])
@@ -110,7 +181,7 @@ class nodecheck(RemoteClientCompass):
         }
         """
         openfile = defaultdict(dict)
-        cmd = r'''cat /proc/sys/fs/file-nr'''
+        cmd = OPENFILE_CMD
         response = self.execute_commands(cmd)
         a = strstrip(response[0]).split()[2]
         b = strstrip(response[0]).split()[0]
@@ -131,7 +202,7 @@ class nodecheck(RemoteClientCompass):
         }
         """
         pid = defaultdict(dict)
-        cmd = r'''ls -ld  /proc/[0-9]* |wc -l;cat /proc/sys/kernel/pid_max'''
+        cmd = PID_CMD
         response = self.execute_commands(cmd)
         pid["pid"]["pid_max"] = strstrip(response[1])
         pid["pid"]["pid_used"] = strstrip(response[0])
@@ -160,7 +231,7 @@ c
         for i in dnslist:
             d = {}
             d["dnsname"] = i
-            cmd = "which host || yum -y -q  install  bind-utils;host {}".format(i)
+            cmd = DNS_CMD.format(i)
             r = self.execute_commands(cmd)
             if isinstance(r, list):
                 d["checkpass"] = True
@@ -195,7 +266,7 @@ c
         }
         """
         diskio = defaultdict(list)
-        cmd = r'''iostat -x 2  5'''
+        cmd = DISKIO_CMD
         response = self.execute_commands(cmd)
         d = defaultdict(list)
         for i in response:
@@ -258,7 +329,7 @@ c
         }
         """
         diskusage = defaultdict(list)
-        cmd = r'''df -h|grep -v -E "token|secret|overlay2|containers|tmpfs|kubernetes.io|Filesystem" '''
+        cmd = DISKUSAGE_CMD
         response = self.execute_commands(cmd)
         for i in response:
             d = {}
@@ -296,9 +367,9 @@ c
         """
 
         nicresult = defaultdict(list)
-        cmd = r'''ip r|grep -v br_bond|grep -E -o "eth[0-9]*|bond[0-9]*|ens[0-9]*"|sort -u'''
+        cmd = NIC_LIST_CMD
         niclist = self.execute_commands(cmd)
-        cmd1 = r'''sar -n DEV 1 8'''
+        cmd1 = NIC_SAR_CMD
         nicstatus = self.execute_commands(cmd1)
         for j in niclist:
             d1 = defaultdict(dict)
@@ -336,7 +407,7 @@ c
         }
         """
         zprocess = defaultdict(dict)
-        cmd = r'''ps -A -ostat,ppid,pid,cmd | grep -e '^[Zz]' '''
+        cmd = ZPROCESS_CMD
         r = self.execute_commands(cmd)
         if isinstance(r, list):
             zprocess["zprocess"]["checkpass"] = False
@@ -357,10 +428,10 @@ c
 
         """
         ntp = defaultdict(dict)
-        cmd = r'''timedatectl  status|grep synchronized|awk -F':| +' '{print $NF}' '''
+        cmd = NTP_SYNC_CMD
         r = self.execute_commands(cmd)
         if strstrip(r[0]) == "yes":
-            cmd = r'''chronyc  sources|grep -E "^\^\*" |cut  -d[ -f 1|awk '{print $NF}' '''
+            cmd = NTP_OFFSET_CMD
             r = self.execute_commands(cmd)
             if r:
                 n = re.findall('\\d+', strstrip(r[0]))[0]
@@ -391,7 +462,7 @@ c
 
     def get_containerd(self):
         containerd = defaultdict(dict)
-        cmd = r'''pgrep -fl containerd|grep -Ev "shim|dockerd|bash"  '''
+        cmd = CONTAINERD_CMD
         r = self.execute_commands(cmd)
         if isinstance(r, list):
             containerd["containerd"]["checkpass"] = True
@@ -409,10 +480,10 @@ c
         }
         """
         kubelet = defaultdict(dict)
-        cmd = r'''systemctl  is-active kubelet '''
+        cmd = KUBELET_ACTIVE_CMD
         r = self.execute_commands(cmd)
         if isinstance(r, list):
-            cmd = r'''curl --connect-timeout 5 -sk  127.0.0.1:10248/healthz'''
+            cmd = KUBELET_HEALTH_CMD
             r1 = self.execute_commands(cmd)
             if isinstance(r1, list) and strstrip(r1[0]) == "ok":
                 kubelet["kubelet"]["process"] = "active"
@@ -428,7 +499,7 @@ c
 
     def get_kubeproxy(self):
         kubeproxy = defaultdict(dict)
-        cmd = r'''curl --connect-timeout 5 -sk 127.0.0.1:10249/healthz'''
+        cmd = KUBEPROXY_HEALTH_CMD
         r = self.execute_commands(cmd)
         if isinstance(r, list) and strstrip(r[0]) == "ok":
             kubeproxy["kubeproxy"]["porthealth"] = True
@@ -436,51 +507,238 @@ c
             kubeproxy["kubeproxy"]["porthealth"] = False
         return kubeproxy
 
-    def start_check(self):
+    @staticmethod
+    def probe_commands(probes=None):
+        commands = list()
+        for probe in probes or PROBES:
+            commands.extend(PROBE_COMMANDS[probe])
+            if probe == "dns":
+                commands.extend(DNS_CMD.format(i) for i in config_obj.get('kubernetes', 'externalDomain').split())
+        return commands
+
+    @staticmethod
+    def batch_script(commands):
+        probes = list()
+        for i, command in enumerate(commands):
+            encoded = base64.b64encode(command.encode()).decode()
+            probes.append(f"probe {i} {encoded}{' &' if command in SAMPLER_CMDS else ''}")
+        return BATCH_SCRIPT.format(probes='\n'.join(probes), ids=' '.join(str(i) for i in range(len(commands))))
+
+    @classmethod
+    def batch_command(cls, commands):
+        script = base64.b64encode(cls.batch_script(commands).encode()).decode()
+        return f"echo {script} | base64 -d | bash"
+
+    @staticmethod
+    def parse_batch(response, commands):
+        """
+        Turn the json document of the batched probe into {command: result}, every result has the shape
+        ``cmd`` returns: the output lines when the command succeeded, the error message otherwise.
+        """
+        data = json.loads(''.join(response))
+        results = dict()
+        for i, command in enumerate(commands):
+            probe = data[str(i)]
+            if probe['rc'] == 0:
+                results[command] = base64.b64decode(probe['out']).decode(errors='replace').splitlines(keepends=True)
+            else:
+                results[command] = base64.b64decode(probe['err']).decode(errors='replace')
+        return results
+
+    def batch_probe(self, probes=None):
+        """
+        Run the commands of every probe in one round trip, the samplers run in parallel on the host.
+        """
+        commands = self.probe_commands(probes)
+        label = f"batched probe {' '.join(probes or PROBES)}"
+        response = self.cmd(self.batch_command(commands), label=label)
+        if not isinstance(response, list):
+            return None
+        try:
+            return self.parse_batch(response, commands)
+        except (ValueError, KeyError) as err:
+            logger.error(f"{self.host} batched probe returned unexpected output: {err}")
+            return None
+
+    def run_probes(self, probes=None):
         check_data = dict()
-        check_data.update(self.get_docker())
-        check_data.update(self.get_load())
-        check_data.update(self.get_contrack())
-        check_data.update(self.get_openfile())
-        check_data.update(self.get_pid())
-        check_data.update(self.get_dns())
-        check_data.update(self.get_diskIO())
-        check_data.update(self.get_diskUsage())
-        check_data.update(self.get_nic())
-        check_data.update(self.get_zprocess())
-        check_data.update(self.get_ntp())
-        check_data.update(self.get_containerd())
-        check_data.update(self.get_kubelet())
-        check_data.update(self.get_kubeproxy())
+        for probe in probes or PROBES:
+            check_data.update(getattr(self, f"get_{probe}")())
         return check_data
 
+    def check_results(self, results, probes=None):
+        """
+        Run the probe parsers against the results of a batched probe, the host is not contacted.
+        """
+        self.execute_commands = results.get
+        try:
+            return self.run_probes(probes)
+        finally:
+            self.execute_commands = self.cmd
+
+    def start_check(self, probes=None):
+        """
+        :param probes: names from PROBES to run, all of them by default
+        """
+        if config_obj.getboolean('node', 'batch_probe', fallback=True):
+            results = self.batch_probe(probes)
+            if results is not None:
+                return self.check_results(results, probes)
+            logger.error(f"{self.host} batched probe failed, fall back to one command per probe")
+        return self.run_probes(probes)
+
+
+class RunResult(object):
+    """
+    Outcome of one fleet check: the node results, the nodes that failed and how long every node took.
+    """
+
+    def __init__(self, listener=None):
+        """
+        :param listener: called with (cluster, ip, result, error) as soon as a node is done
+        """
+        self.successes = list()
+        self.failures = dict()
+        self.timings = dict()
+        self.listener = listener
+        self.__lock = Lock()
+
+    def notify(self, cluster, ip, result, error):
+        if self.listener is None:
+            return
+        try:
+            self.listener(cluster, ip, result, error)
+        except Exception as err:
+            logger.error(f"node {ip} result listener failed: {err}")
+
+    def add_success(self, cluster, ip, result, elapsed):
+        with self.__lock:
+            self.successes.append({cluster: {ip: result}})
+            self.timings[ip] = elapsed
+        self.notify(cluster, ip, result, None)
+
+    def add_failure(self, cluster, ip, error, elapsed):
+        logger.error(f"check node {ip} of {cluster} failed: {error}")
+        with self.__lock:
+            self.failures[ip] = {'cluster': cluster, 'error': str(error)}
+            self.timings[ip] = elapsed
+        self.notify(cluster, ip, None, str(error))
+
+    def latency(self):
+        with self.__lock:
+            return statistics.median(self.timings.values()) if self.timings else None
+
 
 class AllRun(object):
-    def __init__(self, ssh_objs, max_worker=10):
+    """
+    Check every node on a thread pool. The number of nodes in flight is resized after every node so the
+    remaining ones finish within target_duration at the observed ssh latency, between min_worker and
+    max_worker threads.
+    """
+
+    def __init__(self, ssh_objs, max_worker=None, pool=None, min_worker=None, target_duration=None,
+                 listener=None):
         self.ssh_objs = ssh_objs
-        self.max_worker = max_worker
+        self.max_worker = max_worker or config_obj.getint('node', 'max_worker', fallback=50)
+        self.min_worker = min(min_worker or config_obj.getint('node', 'min_worker', fallback=5), self.max_worker)
+        self.target_duration = target_duration or config_obj.getint('node', 'target_duration', fallback=300)
+        self.expected_latency = config_obj.getint('node', 'expected_latency', fallback=20)
+        self.pool = pool
+        self.result = RunResult(listener)
+        self.__running = 0
+        self.__cond = Condition()
+
+    def worker_limit(self, remaining):
+        latency = self.result.latency() or self.expected_latency
+        needed = math.ceil(remaining * latency / self.target_duration)
+        return max(self.min_worker, min(self.max_worker, needed))
 
     def single_exec(self, obj):
-        ip, ssh_user, ssh_port, ssh_pass, ssh_key, cluster = obj
-        n = nodecheck(ip, ssh_user, ssh_port, ssh_pass, ssh_key)
-        r = n.start_check()
-        return {cluster: {ip: r}}
+        ip, ssh_user, ssh_port, ssh_pass, ssh_key, cluster, *probes = obj
+        start = time.monotonic()
+        n = nodecheck(ip, ssh_user, ssh_port, ssh_pass, ssh_key, self.pool)
+        try:
+            r = n.start_check(*probes)
+        except Exception as err:
+            self.result.add_failure(cluster, ip, err, time.monotonic() - start)
+        else:
+            self.result.add_success(cluster, ip, r, time.monotonic() - start)
+        finally:
+            n.close()
 
     def concurrent_run(self):
         f = ThreadPoolExecutor(self.max_worker)
-        for s in self.ssh_objs:
-            try:
-                f.submit(self.single_exec, s).add_done_callback(self.callback)
-            except Exception as err:
-                print(err)
+        for i, s in enumerate(self.ssh_objs):
+            with self.__cond:
+                while self.__running >= self.worker_limit(len(self.ssh_objs) - i):
+                    self.__cond.wait()
+                self.__running += 1
+            f.submit(self.single_exec, s).add_done_callback(self.callback)
         f.shutdown(wait=True)
+        logger.info(f"checked {len(self.result.successes)} nodes, {len(self.result.failures)} failed")
+        return self.result
 
     def callback(self, ssh_result):
-        sr = ssh_result.result()
-        AllResult.append(sr)
+        with self.__cond:
+            self.__running -= 1
+            self.__cond.notify_all()
+
+    def get_result(self):
+        return self.result.successes
+
+
+class AsyncRun(object):
+    """
+    Same job as AllRun on a single asyncio loop with asyncssh, so hundreds of node sessions can be in flight
+    at once. Every node runs the batched probe, bounded by host_timeout, and at most max_concurrency nodes
+    are probed at the same time.
+    """
+
+    def __init__(self, ssh_objs, max_concurrency=None, host_timeout=None, listener=None):
+        self.ssh_objs = ssh_objs
+        self.max_concurrency = max_concurrency or config_obj.getint('node', 'max_concurrency', fallback=200)
+        self.host_timeout = host_timeout or config_obj.getint('node', 'host_timeout', fallback=120)
+        self.result = RunResult(listener)
+
+    @staticmethod
+    async def probe(ip, ssh_user, ssh_port, ssh_pass, ssh_key, probes=None):
+        options = {'username': ssh_user, 'port': ssh_port, 'known_hosts': None}
+        if ssh_key == "ssh-global":
+            options['client_keys'] = ['./tmp/private.pem']
+        else:
+            options['password'] = ssh_pass
+        commands = nodecheck.probe_commands(probes)
+        async with asyncssh.connect(ip, **options) as conn:
+            completed = await conn.run(nodecheck.batch_command(commands), check=True)
+        results = nodecheck.parse_batch(completed.stdout.splitlines(keepends=True), commands)
+        return nodecheck(ip, ssh_user, ssh_port, ssh_pass, ssh_key).check_results(results, probes)
+
+    async def single_exec(self, obj, semaphore):
+        ip, ssh_user, ssh_port, ssh_pass, ssh_key, cluster, *probes = obj
+        async with semaphore:
+            start = time.monotonic()
+            try:
+                r = await asyncio.wait_for(self.probe(ip, ssh_user, ssh_port, ssh_pass, ssh_key, *probes),
+                                           self.host_timeout)
+            except asyncio.TimeoutError:
+                self.result.add_failure(cluster, ip, f"timed out after {self.host_timeout}s",
+                                        time.monotonic() - start)
+            except Exception as err:
+                self.result.add_failure(cluster, ip, err, time.monotonic() - start)
+            else:
+                self.result.add_success(cluster, ip, r, time.monotonic() - start)
+
+    async def run_all(self):
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        await asyncio.gather(*(self.single_exec(s, semaphore) for s in self.ssh_objs))
+
+    def concurrent_run(self):
+        asyncio.run(self.run_all())
+        logger.info(f"checked {len(self.result.successes)} nodes, {len(self.result.failures)} failed")
+        return self.result
 
     def get_result(self):
-        return AllResult
+        return self.result.successes
 
 # def checknode(ip: str, ssh_user:str,ssh_port:int,ssh_pass:str,ssh_key:str):
 #     c = {}
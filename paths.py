@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+jsonpath expressions compiled once into plain accessor functions for the hot paths over pod, node and
+service lists
+
+the supported subset is ``$`` followed by ``.key``, ``[*]``, ``[key,key]`` and ``[index]`` steps, other
+expressions such as filters, slices and negative indexes raise ValueError. A
+compiled path returns the same matches as ``jsonpath.jsonpath``, except that no match is an empty list
+instead of False, so the ``or []`` guards are not needed:
+
+>>> import jsonpath
+>>> def same(data, expr):
+...     return compile_path(expr)(data) == jsonpath.jsonpath(data, expr)
+>>> pods = [{'status': {'pod_ip': '10.0.0.1'}}, {'status': {'pod_ip': None}}, {'status': {}}, {}]
+>>> same(pods, '$[*].status.pod_ip'), same({'status': {'phase': None}}, '$.status.phase')
+(True, True)
+>>> nodes = [{'status': {'addresses': [{'address': '1.1.1.1'}, {'type': 'Hostname'}]}}]
+>>> same(nodes, '$[*].status.addresses[*].address')
+True
+>>> cluster = {'status': {'masters': [{'name': 'm1'}], 'nodes': [{'name': 'n1'}, {'name': 'n2'}]}}
+>>> same(cluster, '$.status[masters,nodes][*]'), same(cluster, '$.status[nodes,masters][0].name')
+(True, True)
+>>> same([{'a': False}, {'a': 0}, {'a': ''}], '$[*].a'), same({'a': {'b': 1, 'c': [2]}}, '$.a[*]')
+(True, True)
+>>> compile_path('$[*].a')([]), jsonpath.jsonpath([], '$[*].a')
+([], False)
+"""
+import re
+from functools import lru_cache
+
+STEP_PATTERN = re.compile(r"\.([^.\[\]]+)|\[([^\]]*)\]")
+
+
+def key_step(name):
+    def step(values):
+        return [v[name] for v in values if isinstance(v, dict) and name in v]
+    return step
+
+
+def wildcard_step(values):
+    result = list()
+    for v in values:
+        if isinstance(v, dict):
+            result.extend(v.values())
+        elif isinstance(v, list):
+            result.extend(v)
+    return result
+
+
+def union_step(names):
+    def step(values):
+        return [v[name] for v in values if isinstance(v, dict) for name in names if name in v]
+    return step
+
+
+def index_step(index):
+    def step(values):
+        return [v[index] for v in values if isinstance(v, list) and index < len(v)]
+    return step
+
+
+def parse_steps(expr):
+    if not expr.startswith("$"):
+        raise ValueError(f"path {expr!r} does not start with $")
+    steps = list()
+    position = 1
+    for match in STEP_PATTERN.finditer(expr, 1):
+        if match.start() != position:
+            break
+        position = match.end()
+        key, bracket = match.groups()
+        if key is not None:
+            steps.append(key_step(key))
+        elif bracket == "*":
+            steps.append(wildcard_step)
+        elif re.fullmatch(r"\d+", bracket):
+            steps.append(index_step(int(bracket)))
+        elif re.search(r"[?@():]|^\s*-", bracket):
+            # filters, scripts, slices and negative indexes
+            raise ValueError(f"unsupported path {expr!r} at [{bracket}]")
+        else:
+            steps.append(union_step([name.strip().strip("'\"") for name in bracket.split(",")]))
+    if position != len(expr):
+        raise ValueError(f"unsupported path {expr!r} at {expr[position:]!r}")
+    return steps
+
+
+@lru_cache(maxsize=None)
+def compile_path(expr):
+    """
+    :return: a function of the document returning the list of matches
+    """
+    steps = parse_steps(expr)
+    names = re.findall(r"\.([^.\[\]]+)", expr)
+    if len(names) == len(steps) and "[" not in expr:
+        # plain key chain, walk the document without building the intermediate lists
+        def extract_keys(obj):
+            for name in names:
+                if not isinstance(obj, dict) or name not in obj:
+                    return []
+                obj = obj[name]
+            return [obj]
+        return extract_keys
+
+    def extract(obj):
+        values = [obj]
+        for step in steps:
+            values = step(values)
+        return values
+    return extract
+
+
+def compile_fields(*exprs):
+    """
+    Extract several fields of every item of a list in one pass, a field is the first match of its path on
+    the item or None.
+
+    >>> pod_fields = compile_fields('$.metadata.name', '$.status.phase')
+    >>> pod_fields([{'metadata': {'name': 'a'}, 'status': {'phase': 'Running'}}, {'metadata': {'name': 'b'}}])
+    [('a', 'Running'), ('b', None)]
+    """
+    paths = [compile_path(expr) for expr in exprs]
+
+    def extract(items):
+        rows = list()
+        for item in items:
+            row = list()
+            for path in paths:
+                values = path(item)
+                row.append(values[0] if values else None)
+            rows.append(tuple(row))
+        return rows
+    return extract
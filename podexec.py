@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+many commands run in a pod through one exec session
+
+the commands are sent as a shell script on stdin and run in parallel batches in the pod. Every command prints
+its result line as soon as it finishes, so one websocket serves a whole check instead of one per command and
+a command still running at the timeout only loses its own result.
+"""
+import base64
+import shlex
+
+from kubernetes.stream import stream
+from kubernetes.stream.ws_client import STDOUT_CHANNEL
+
+MARKER = "@@colombia-probe"
+# bytes of output kept per command, a result line stays below PIPE_BUF so parallel lines do not interleave
+OUTPUT_TAIL = 2048
+
+
+def probe_script(commands, parallel=50):
+    """
+    Shell script running the commands, at most parallel at a time. The result of a command is one line:
+    the marker, its index, its exit status and the base64 tail of its output.
+
+    :param commands: argv lists, or lists of argv lists tried in turn until one succeeds, the output is the
+        one of the last attempt
+    """
+    lines = ['d=$(mktemp -d)']
+    for i, command in enumerate(commands):
+        attempts = command if command and isinstance(command[0], (list, tuple)) else [command]
+        run = ' || '.join(' '.join(shlex.quote(str(arg)) for arg in argv) + f' </dev/null >"$d/{i}" 2>&1'
+                          for argv in attempts)
+        lines.append(f'( {run}; rc=$?; echo "{MARKER} {i} $rc $(tail -c {OUTPUT_TAIL} "$d/{i}" | base64 | '
+                     f'tr -d \'\\n\')" ) &')
+        if (i + 1) % parallel == 0:
+            lines.append('wait')
+    lines.append('wait')
+    lines.append('rm -rf "$d"')
+    lines.append('exit 0')
+    return '\n'.join(lines) + '\n'
+
+
+def parse_results(output, count):
+    """
+    :return: (returncode, output) of every command, (None, '') for the ones without a result
+
+    >>> parse_results("@@colombia-probe 1 1 ZmFpbGVk\\nnoise\\n@@colombia-probe 0 0 \\n", 3)
+    [(0, ''), (1, 'failed'), (None, '')]
+    """
+    results = [(None, '')] * count
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) not in (3, 4) or fields[0] != MARKER or not fields[1].isdigit():
+            continue
+        index = int(fields[1])
+        if index >= count:
+            continue
+        rc = int(fields[2]) if fields[2].lstrip('-').isdigit() else None
+        text = base64.b64decode(fields[3]).decode(errors='replace') if len(fields) == 4 else ''
+        results[index] = (rc, text.rstrip('\n'))
+    return results
+
+
+def run_commands(core_v1_api, name, ns, commands, timeout=300, parallel=50):
+    """
+    Run the commands in the pod through one exec session.
+
+    :return: (returncode, output) of every command in order, see parse_results
+    """
+    if not commands:
+        return []
+    resp = stream(core_v1_api.connect_get_namespaced_pod_exec, name, ns, command=['sh'],
+                  stderr=True, stdin=True, stdout=True, tty=False, _preload_content=False)
+    try:
+        resp.write_stdin(probe_script(commands, parallel))
+        resp.run_forever(timeout=timeout)
+        output = resp.read_channel(STDOUT_CHANNEL)
+    finally:
+        resp.close()
+    return parse_results(output, len(commands))
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+report storage in redis: the final report, the partial report of the running check and the progress
+events the web ui listens to
+
+every saved report is a new version, each cluster of it is one hash ``report:v<version>:<cluster>`` with a
+field per section and the platform wide checks share the hash ``report:v<version>:``, values are encoded by
+codec.py. The small index key names the current version and the nav, it is switched in the same transaction
+that writes the version.
+The pod and node views are stored as tables, see tables.py, the table api pages through their sort orders.
+Pages rendered from a version are cached in its hash ``report:v<version>:pages`` and expire with it.
+"""
+import json
+import random
+import time
+from collections import defaultdict
+from threading import Lock
+
+from redis import Redis
+
+import codec
+from log import logger
+from tables import TABLES, build_table
+from utils import config_obj
+
+REPORT_VERSION_KEY = "report:version"
+REPORT_INDEX_KEY = "report:index"
+# top level checkout entries that are platform wide checks, every other entry is a cluster
+GLOBAL_SECTIONS = ("license", "volumes_status")
+# seconds a replaced version is kept for the requests still reading it
+OLD_VERSION_TTL = 300
+PAGES_SCOPE = "pages"
+PARTIAL_KEY = "report:partial"
+FRESHNESS_KEY = "report:freshness"
+PROGRESS_CHANNEL = "progress"
+
+
+def status_of(data):
+    """
+    Overall status of a check result: False as soon as one nested ``status`` is False.
+    """
+    if isinstance(data, dict):
+        if data.get('status') is False:
+            return False
+        return all(status_of(v) for v in data.values())
+    if isinstance(data, list):
+        return all(status_of(v) for v in data)
+    return True
+
+
+class Freshness:
+    """
+    Expiry time of every result kept in the report, keyed by (scope, name): scope is the cluster or node ip
+    the result belongs to, empty for platform wide checks. A forced run treats everything as expired.
+    Every ttl is shortened by a random part of up to jitter, so results checked together expire apart.
+    The keys marked since the instance was loaded are the results checked in this run.
+    """
+
+    def __init__(self, expires=None, force=False):
+        self.expires = expires or dict()
+        self.force = force
+        self.jitter = config_obj.getfloat("schedule", "jitter", fallback=0.1)
+        self.marked = set()
+        self.lock = Lock()
+
+    @staticmethod
+    def ttl(name, default):
+        return config_obj.getint("ttl", name, fallback=default)
+
+    def fresh(self, scope, name):
+        return self.expiry(scope, name) > time.time()
+
+    def expiry(self, scope, name):
+        return 0 if self.force else self.expires.get((scope, name), 0)
+
+    def mark(self, scope, name, ttl):
+        with self.lock:
+            self.expires[(scope, name)] = time.time() + ttl * (1 - random.uniform(0, self.jitter))
+            self.marked.add((scope, name))
+
+    def prune(self, scopes):
+        """
+        Drop the expiry times of every scope not in scopes.
+        """
+        with self.lock:
+            self.expires = {key: expiry for key, expiry in self.expires.items() if key[0] in scopes}
+
+    def scope_expires(self, scope):
+        with self.lock:
+            return {key: expiry for key, expiry in self.expires.items() if key[0] == scope}
+
+    def snapshot(self, restore=None):
+        """
+        Copy taken under the lock, so checks still running can not change it while it is stored.
+
+        :param restore: {scope: {key: expiry}}, the keys of these scopes are put back to the given expiry
+            times and are not counted as checked in this run
+        """
+        with self.lock:
+            expires, marked = dict(self.expires), set(self.marked)
+        for scope, scope_expires in (restore or {}).items():
+            expires = {key: expiry for key, expiry in expires.items() if key[0] != scope}
+            expires.update(scope_expires)
+            marked = {key for key in marked if key[0] != scope}
+        copy = Freshness(expires, self.force)
+        copy.marked = marked
+        return copy
+
+
+class ReportStore:
+    def __init__(self, host="localhost"):
+        self.redis = Redis(host)
+
+    @staticmethod
+    def report_key(version, scope):
+        return f"report:v{version}:{scope}"
+
+    @classmethod
+    def table_keys(cls, version, scope, table):
+        base = f"{cls.report_key(version, scope)}:{table}"
+        return [f"{base}:rows", f"{base}:text"] + [f"{base}:order:{i}" for i in range(TABLES[table][1])]
+
+    def save_table(self, pipe, version, scope, table, view):
+        rows_key, text_key, *order_keys = self.table_keys(version, scope, table)
+        rows, text, orders = build_table(table, view)
+        if rows:
+            pipe.hset(rows_key, mapping={i: json.dumps(row, default=str) for i, row in enumerate(rows)})
+            for order_key, order in zip(order_keys, orders):
+                pipe.rpush(order_key, *order)
+        pipe.set(text_key, json.dumps(text))
+        return len(rows)
+
+    def save(self, checkout, freshness=None):
+        previous = self.read_index()
+        version = self.redis.incr(REPORT_VERSION_KEY)
+        pipe = self.redis.pipeline()
+        scopes = {""}
+        tables = dict()
+        for name, data in checkout.items():
+            if name in GLOBAL_SECTIONS:
+                pipe.hset(self.report_key(version, ""), name, codec.dumps(data))
+            elif data:
+                scopes.add(name)
+                views = {view: table for table, (view, _) in TABLES.items()}
+                pipe.hset(self.report_key(version, name), mapping={
+                    section: codec.dumps(value) for section, value in data.items() if section not in views})
+                tables[name] = {views[section]: self.save_table(pipe, version, name, views[section], value)
+                                for section, value in data.items() if section in views}
+        index = {"version": version, "format": codec.FORMAT_VERSION, "nav": list(checkout),
+                 "scopes": sorted(scopes), "tables": tables, "saved_at": time.time()}
+        pipe.set(REPORT_INDEX_KEY, json.dumps(index))
+        if freshness is not None:
+            pipe.set(FRESHNESS_KEY, codec.dumps(freshness.snapshot().expires))
+        if previous is not None:
+            # readers of the previous version get OLD_VERSION_TTL to finish, one in another format can not
+            # be read any more and is dropped at once
+            ttl = OLD_VERSION_TTL if previous.get("format") == codec.FORMAT_VERSION else 0
+            for scope in previous.get("scopes", []) + [PAGES_SCOPE]:
+                pipe.expire(self.report_key(previous["version"], scope), ttl)
+            for scope, scope_tables in previous.get("tables", {}).items():
+                for table in scope_tables:
+                    if table in TABLES:
+                        for key in self.table_keys(previous["version"], scope, table):
+                            pipe.expire(key, ttl)
+        pipe.execute()
+        logger.info(f"report version {version} save to redis has been completed")
+
+    def read_index(self):
+        index = self.redis.get(REPORT_INDEX_KEY)
+        return None if index is None else json.loads(index)
+
+    def load_index(self):
+        """
+        Index of the current report, None before the first report or when it was stored in another format.
+        """
+        index = self.read_index()
+        return index if index is not None and index.get("format") == codec.FORMAT_VERSION else None
+
+    def fetch(self, index, scopes):
+        """
+        Load sections of the report version named by index in one round trip.
+
+        :param scopes: {scope: [section, ...]}, the scope is a cluster or empty for the platform wide checks,
+                       None instead of the list loads every section of the scope
+        :return: {scope: {section: value}}, missing sections are left out
+        """
+        pipe = self.redis.pipeline(transaction=False)
+        for scope, sections in scopes.items():
+            key = self.report_key(index["version"], scope)
+            if sections is None:
+                pipe.hgetall(key)
+            else:
+                pipe.hmget(key, sections)
+        report = dict()
+        for (scope, sections), values in zip(scopes.items(), pipe.execute()):
+            if sections is None:
+                items = ((section.decode("utf-8"), value) for section, value in values.items())
+            else:
+                items = zip(sections, values)
+            report[scope] = {section: codec.loads(value) for section, value in items if value is not None}
+        return report
+
+    def get_page(self, index, path):
+        return self.redis.hget(self.report_key(index["version"], PAGES_SCOPE), path)
+
+    def set_page(self, index, path, page):
+        self.redis.hset(self.report_key(index["version"], PAGES_SCOPE), path, page)
+
+    def query_table(self, index, scope, table, start=0, length=10, column=0, descending=False, search=""):
+        """
+        One page of a pod or node table, sorted by a column and filtered by a case insensitive search.
+        Without a search only the rows of the page are read.
+
+        :param length: rows of the page, -1 for all of them
+        :return: total rows, rows left by the search and the rows of the page
+        """
+        total = index.get("tables", {}).get(scope, {}).get(table)
+        if not total:
+            return 0, 0, []
+        rows_key, text_key, *order_keys = self.table_keys(index["version"], scope, table)
+        order_key = order_keys[column]
+        length = total if length < 0 else length
+        if search:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.lrange(order_key, 0, -1)
+            pipe.get(text_key)
+            order, text = pipe.execute()
+            text = json.loads(text)
+            search = search.lower()
+            ids = [i for i in order if search in text[int(i)]]
+            if descending:
+                ids.reverse()
+            filtered = len(ids)
+            ids = ids[start:start + length]
+        elif start >= total:
+            return total, total, []
+        else:
+            filtered = total
+            if descending:
+                ids = self.redis.lrange(order_key, max(total - start - length, 0), total - start - 1)[::-1]
+            else:
+                ids = self.redis.lrange(order_key, start, start + length - 1)
+        if not ids:
+            return total, filtered, []
+        return total, filtered, [json.loads(row) for row in self.redis.hmget(rows_key, ids)]
+
+    def load(self):
+        """
+        The whole current report as the checkout dict the checks fill, None before the first report.
+        """
+        index = self.load_index()
+        if index is None:
+            return None
+        report = self.fetch(index, {scope: None for scope in index["scopes"]})
+        checkout = defaultdict(dict)
+        for name in index["nav"]:
+            checkout[name] = report[""][name] if name in GLOBAL_SECTIONS else report.get(name, dict())
+        return checkout
+
+    def load_freshness(self, force=False):
+        expires = self.redis.get(FRESHNESS_KEY)
+        try:
+            return Freshness(codec.loads(expires) if expires is not None else None, force)
+        except ValueError:
+            return Freshness(force=force)
+
+    def start_run(self):
+        self.redis.delete(PARTIAL_KEY)
+
+    def publish(self, kind, scope, name, data):
+        """
+        Store one result in the partial report and announce it on the progress channel.
+
+        :param kind: check, node or cluster
+        :param scope: cluster the result belongs to, empty for platform wide checks
+        :param name: check key, node ip or cluster name
+        """
+        event = {"kind": kind, "scope": scope, "name": name, "status": status_of(data)}
+        if kind != "cluster":
+            event["data"] = data
+        pipe = self.redis.pipeline()
+        pipe.hset(PARTIAL_KEY, f"{kind}:{scope}:{name}", codec.dumps(data))
+        pipe.publish(PROGRESS_CHANNEL, json.dumps(event, default=str))
+        pipe.execute()
+
+    def publish_checks(self, checkout, keys, clusters):
+        for key in keys:
+            if key in checkout:
+                self.publish("check", "", key, checkout[key])
+            for cluster in clusters:
+                if key in checkout.get(cluster, {}):
+                    self.publish("check", cluster, key, checkout[cluster][key])
+
+    def load_partial(self):
+        partial = defaultdict(dict)
+        for field, value in self.redis.hgetall(PARTIAL_KEY).items():
+            kind, scope, name = field.decode("utf-8").split(":", 2)
+            data = codec.loads(value)
+            if kind == "cluster":
+                partial[name].update(data)
+            elif kind == "node":
+                partial[scope].setdefault("node_info", dict())[name] = data
+            elif scope:
+                partial[scope][name] = data
+            else:
+                partial[name] = data
+        return partial
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 _*-
+"""
+pod and node tables of the cluster page: the columns, the rows built from the merged views and the sort
+order of every column, precomputed when the report is stored so the table api only slices them
+"""
+import datetime
+
+
+def cell(data, *keys):
+    for key in keys:
+        if not isinstance(data, dict) or key not in data:
+            return ''
+        data = data[key]
+    return '' if data is None else data
+
+
+def disk_usage(node):
+    return ' '.join(str(v) for r in node.get('diskusage') or [] for v in r.values())
+
+
+POD_COLUMNS = ['ns', 'name', 'status', 'restart', 'start_time', 'ip', 'host', 'cpu', 'cpu_requests', 'cpu_limits',
+               'memory', 'memory_requests', 'memory_limits']
+# node column and the function building its cell from a node view entry
+NODE_COLUMNS = [
+    ('ip', lambda ip, v: ip),
+    ('Hostname', lambda ip, v: cell(v, 'Hostname')),
+    ('docker', lambda ip, v: cell(v, 'docker', 'dockerProcess')),
+    ('nodeload', lambda ip, v: cell(v, 'nodeload', 'loadaverage')),
+    ('contrack', lambda ip, v: cell(v, 'contrack', 'contrack_used')),
+    ('openfile', lambda ip, v: cell(v, 'openfile', 'openfile_used')),
+    ('pid', lambda ip, v: cell(v, 'pid', 'pid_used')),
+    ('dns', lambda ip, v: 1),
+    ('diskIO', lambda ip, v: 1),
+    ('diskUsage', lambda ip, v: disk_usage(v)),
+    ('nicIO', lambda ip, v: 1),
+    ('zprocess', lambda ip, v: cell(v, 'zprocess', 'checkpass')),
+    ('ntp', lambda ip, v: cell(v, 'ntp', 'checkpass')),
+    ('containerd', lambda ip, v: cell(v, 'containerd', 'checkpass')),
+    ('kubelet', lambda ip, v: cell(v, 'kubelet', 'process')),
+    ('kubeproxy', lambda ip, v: cell(v, 'kubeproxy', 'porthealth')),
+    ('container_runtime', lambda ip, v: cell(v, 'container_runtime')),
+    ('status', lambda ip, v: cell(v, 'status')),
+    ('kernel', lambda ip, v: cell(v, 'kernel')),
+    ('capacity', lambda ip, v: f"{cell(v, 'cpu')} / {cell(v, 'memory')}"),
+    ('usage', lambda ip, v: f"{cell(v, 'cpu_usage')} / {cell(v, 'mem_usage')}"),
+    ('probe', lambda ip, v: f"failed, results are stale: {v['probe_error']}" if v.get('probe_error') else 'ok'),
+]
+# table name, the view it is built from and its number of columns
+TABLES = {"pods": ("pod_view", len(POD_COLUMNS)), "nodes": ("node_view", len(NODE_COLUMNS))}
+
+
+def pod_rows(pod_view):
+    return [[cell(pod, column) for column in POD_COLUMNS] for pod in pod_view]
+
+
+def node_rows(node_view):
+    return [[build(ip, node) for _, build in NODE_COLUMNS] for ip, node in node_view.items()]
+
+
+def sort_key(value):
+    """
+    Numbers sort before and apart from text, so mixed columns still have a total order.
+
+    >>> sorted([10, '9', 2.5, '', 'a'], key=sort_key)
+    [2.5, 10, '', '9', 'a']
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return 0, value, ''
+    if isinstance(value, datetime.datetime):
+        return 1, 0, value.isoformat()
+    return 1, 0, str(value)
+
+
+def build_table(name, view):
+    """
+    :return: rows, the lower case text every row is searched in and the row ids sorted by each column
+    """
+    rows = pod_rows(view) if name == "pods" else node_rows(view)
+    text = [' '.join(str(v) for v in row).lower() for row in rows]
+    orders = [sorted(range(len(rows)), key=lambda i: sort_key(rows[i][column])) for column in range(TABLES[name][1])]
+    return rows, text, orders
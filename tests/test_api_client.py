@@ -0,0 +1,45 @@
+import yaml
+from kubernetes import client
+
+import clusters
+from clusters import ReloadingApiClient, get_api_client, prune_api_clients
+
+
+def write_kubeconfig(path, token):
+    kubeconfig = {'apiVersion': 'v1', 'kind': 'Config', 'current-context': 'c1',
+                  'clusters': [{'name': 'c1', 'cluster': {'server': 'https://10.0.0.1:6443'}}],
+                  'users': [{'name': 'u1', 'user': {'token': token}}],
+                  'contexts': [{'name': 'c1', 'context': {'cluster': 'c1', 'user': 'u1'}}]}
+    path.write_text(yaml.dump(kubeconfig))
+    return str(path)
+
+
+def test_unauthorized_request_reloads_the_kubeconfig(tmp_path, monkeypatch):
+    kube_conf = write_kubeconfig(tmp_path / 'c1', 'old')
+    api_client = ReloadingApiClient(kube_conf)
+    tokens = list()
+
+    def call_api(self, *args, **kwargs):
+        token = self.configuration.api_key['authorization']
+        tokens.append(token)
+        if token != 'Bearer new':
+            raise client.exceptions.ApiException(status=401, reason='Unauthorized')
+        return 'ok'
+
+    monkeypatch.setattr(client.ApiClient, 'call_api', call_api)
+    write_kubeconfig(tmp_path / 'c1', 'new')
+    assert api_client.call_api('/api/v1/nodes', 'GET') == 'ok'
+    assert tokens == ['Bearer old', 'Bearer new']
+
+
+def test_clients_follow_the_kubeconfig_and_cluster_list(tmp_path, monkeypatch):
+    monkeypatch.setattr(clusters, 'API_CLIENTS', dict())
+    c1 = write_kubeconfig(tmp_path / 'c1', 'a')
+    c2 = write_kubeconfig(tmp_path / 'c2', 'a')
+    first = get_api_client(c1)
+    assert get_api_client(c1) is first
+    write_kubeconfig(tmp_path / 'c1', 'b')
+    assert get_api_client(c1) is not first
+    get_api_client(c2)
+    prune_api_clients([c2])
+    assert list(clusters.API_CLIENTS) == [c2]
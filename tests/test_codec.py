@@ -0,0 +1,43 @@
+import datetime
+from collections import defaultdict
+
+import pytest
+
+import codec
+from k8s import NodeMetric, PodMetric
+
+REPORT = {
+    "start_time": datetime.datetime(2021, 4, 9, 10, 0, 1),
+    "aware": datetime.datetime(2021, 4, 9, 10, 0, tzinfo=datetime.timezone.utc),
+    "day": datetime.date(2021, 4, 9),
+    "elapsed": datetime.timedelta(seconds=90),
+    "tuple": (1, "a"),
+    "set": {1, 2},
+    "nodes": defaultdict(dict, {"10.0.0.1": {"load": 0.5}}),
+    ("ns", "pod"): {"container": (0.1, 1024)},
+    "metrics": [PodMetric("ns", "pod", "Running", 0.1, 64, 0.1, 1, 0.1, 1), NodeMetric("node-1", 0.5, 1024)],
+    "text": "x" * 2048,
+    "tagged": {"__t": "not a tag"},
+}
+
+
+@pytest.mark.parametrize("serializer", sorted(codec.SERIALIZERS))
+@pytest.mark.parametrize("compression", sorted(codec.COMPRESSIONS))
+def test_round_trip(serializer, compression):
+    if serializer == "msgpack" and codec.msgpack is None or compression == "zstd" and codec.zstandard is None:
+        pytest.skip("serializer or compression not installed")
+    value = codec.loads(codec.dumps(REPORT, serializer, compression))
+    assert value == REPORT
+    assert isinstance(value["nodes"], defaultdict) and value["nodes"]["missing"] == {}
+    assert type(value["metrics"][0]) is PodMetric and type(value["metrics"][1]) is NodeMetric
+    assert type(value["tuple"]) is tuple
+
+
+def test_rejects_other_data():
+    with pytest.raises(ValueError):
+        codec.loads(b"\x80\x04pickle")
+
+
+def test_rejects_unknown_types():
+    with pytest.raises(TypeError):
+        codec.dumps({"obj": object()}, "json", "none")
@@ -0,0 +1,16 @@
+from storage import Freshness
+
+
+def test_prune_keeps_only_the_given_scopes():
+    freshness = Freshness({('', 'license'): 1, ('c1', 'cidr'): 2, ('c2', 'cidr'): 3, ('10.0.0.1', 'node_load'): 4})
+    freshness.prune({'', 'c1', '10.0.0.1'})
+    assert freshness.expires == {('', 'license'): 1, ('c1', 'cidr'): 2, ('10.0.0.1', 'node_load'): 4}
+
+
+def test_snapshot_restores_timed_out_scopes():
+    freshness = Freshness({('c1', 'cidr'): 1})
+    freshness.mark('c1', 'cidr', 600)
+    freshness.mark('c2', 'cidr', 600)
+    snapshot = freshness.snapshot({'c1': {('c1', 'cidr'): 1}})
+    assert snapshot.expires[('c1', 'cidr')] == 1 and ('c2', 'cidr') in snapshot.expires
+    assert snapshot.marked == {('c2', 'cidr')}
@@ -0,0 +1,81 @@
+from types import SimpleNamespace
+
+from kubernetes import client
+
+from clusters import Cluster
+from utils import config_obj
+
+
+class Item:
+    def __init__(self, namespace, name):
+        self.namespace = namespace
+        self.name = name
+
+    def to_dict(self):
+        return {'metadata': {'namespace': self.namespace, 'name': self.name}}
+
+
+def paged_list(items, expire_at=None):
+    """
+    A list call serving items in pages of limit, the continue token of the page at expire_at expires once.
+    """
+    calls = list()
+
+    def list_pods(limit, _continue=None):
+        start = int(_continue or 0)
+        calls.append(start)
+        if start and start == expire_at and calls.count(start) == 1:
+            raise client.exceptions.ApiException(status=410, reason="Gone")
+        end = start + limit
+        return SimpleNamespace(items=items[start:end],
+                               metadata=SimpleNamespace(_continue=str(end) if end < len(items) else None))
+    return list_pods, calls
+
+
+def names(pages):
+    return [item['metadata']['name'] for page in pages for item in page]
+
+
+def setup_module():
+    config_obj.read_dict({'kubernetes': {'page_size': '2', 'raw_json': 'false'}})
+
+
+def teardown_module():
+    config_obj.remove_section('kubernetes')
+
+
+def test_pages():
+    items = [Item('default', f'app-{i}') for i in range(5)]
+    list_pods, calls = paged_list(items)
+    assert names(Cluster.list_pages(list_pods, 'V1Pod')) == [f'app-{i}' for i in range(5)]
+    assert calls == [0, 2, 4]
+
+
+def test_expired_continue_restarts_without_duplicates():
+    items = [Item('default', f'app-{i}') for i in range(5)]
+    list_pods, calls = paged_list(items, expire_at=4)
+    assert names(Cluster.list_pages(list_pods, 'V1Pod')) == [f'app-{i}' for i in range(5)]
+    assert calls == [0, 2, 4, 0, 2, 4]
+
+
+def test_cluster_scoped_items_restart_by_name():
+    items = [Item(None, f'node-{i}') for i in range(3)]
+    list_pods, _ = paged_list(items, expire_at=2)
+    pages = Cluster.list_pages(list_pods, 'V1Node')
+    assert names([next(pages)]) == ['node-0', 'node-1']
+    assert names(pages) == ['node-2']
+
+
+def test_expired_continue_after_an_empty_page():
+    calls = list()
+
+    def list_pods(limit, _continue=None):
+        calls.append(_continue)
+        if len(calls) == 1:
+            return SimpleNamespace(items=[], metadata=SimpleNamespace(_continue='1'))
+        if _continue is not None:
+            raise client.exceptions.ApiException(status=410, reason="Gone")
+        return SimpleNamespace(items=[Item('default', 'app-0')], metadata=SimpleNamespace(_continue=None))
+
+    assert names(Cluster.list_pages(list_pods, 'V1Pod')) == ['app-0']
+    assert calls == [None, '1', None]
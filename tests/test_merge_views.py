@@ -0,0 +1,58 @@
+from k8s import NodeMetric, PodMetric
+from tables import node_rows
+from utils import merge_views
+
+
+def cluster(context, node_info=None):
+    return {'context': context, 'node_info': node_info or {}}
+
+
+def full_context():
+    return {
+        'node': {'result': [{'InternalIP': '10.0.0.1', 'Hostname': 'node-1', 'status': 'Ready'}]},
+        'pod': {'result': [{'ns': 'default', 'name': 'app', 'status': 'Running'}]},
+        'metric': {'nodes': [NodeMetric(node='node-1', cpu=0.5, memory=1024)],
+                   'pods': [PodMetric(ns='default', pod='app', status='Running', cpu=0.1, memory=64,
+                                      cpu_requests=0.1, cpu_limits=1, memory_requests=0.1, memory_limits=1)],
+                   'rollups': {'ns': {'default': {'pods': 1, 'memory': 0.06}}}},
+    }
+
+
+def test_full_cluster():
+    checkout = {'c1': cluster(full_context(), {'10.0.0.1': {'kernel': '5.4'}})}
+    merge_views(checkout)
+    node = checkout['c1']['node_view']['10.0.0.1']
+    assert node['kernel'] == '5.4' and node['Hostname'] == 'node-1' and node['cpu_usage'] == 0.5
+    assert checkout['c1']['pod_view'][0]['memory'] == 64
+    assert checkout['c1']['resource_rollups']['ns']['default']['pods'] == 1
+    assert 'error' not in checkout['c1']
+
+
+def test_missing_address_and_metrics():
+    context = full_context()
+    context['node']['result'].append({'Hostname': 'node-2'})
+    del context['metric']
+    checkout = {'c1': cluster(context, {'10.0.0.1': {}})}
+    merge_views(checkout)
+    assert list(checkout['c1']['node_view']) == ['10.0.0.1']
+    assert 'cpu' not in checkout['c1']['pod_view'][0]
+
+
+def test_broken_cluster_does_not_stop_the_others():
+    broken = full_context()
+    broken['pod'] = {'result': [None]}
+    checkout = {'license': {'data': {}}, 'broken': cluster(broken), 'c1': cluster(full_context())}
+    merge_views(checkout)
+    assert 'merge views failed' in checkout['broken']['error']
+    assert 'node_view' not in checkout['broken'] and 'pod_view' not in checkout['broken']
+    assert checkout['c1']['pod_view'][0]['name'] == 'app'
+
+
+def test_failed_probes_are_marked():
+    checkout = {'c1': cluster(full_context(), {'10.0.0.1': {'kernel': '5.4'}})}
+    checkout['c1']['node_failures'] = {'10.0.0.1': 'timed out', '10.0.0.2': 'auth failed'}
+    merge_views(checkout)
+    node_view = checkout['c1']['node_view']
+    assert node_view['10.0.0.1']['kernel'] == '5.4' and node_view['10.0.0.1']['probe_error'] == 'timed out'
+    assert node_view['10.0.0.2'] == {'probe_error': 'auth failed'}
+    assert node_rows(node_view)[1][-1] == 'failed, results are stale: auth failed'
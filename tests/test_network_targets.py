@@ -0,0 +1,42 @@
+from check import CheckK8s
+
+
+class Snapshot:
+    def __init__(self, pods):
+        self.pods = pods
+
+    def pages(self, kind):
+        yield self.pods
+
+
+def pod(host_ip, pod_ip):
+    return {'status': {'host_ip': host_ip, 'pod_ip': pod_ip}}
+
+
+def check_network(pods):
+    k8s_obj = CheckK8s.__new__(CheckK8s)
+    k8s_obj.cluster_name = 'c1'
+    k8s_obj.checkout = {'c1': {}}
+    k8s_obj.snapshot = Snapshot(pods)
+    pinged = list()
+
+    def run_probes(commands):
+        pinged.extend(command[-1] for command in commands)
+        return [(0, '2 packets transmitted, 2 received, 0% packet loss')] * len(commands)
+
+    k8s_obj.run_probes = run_probes
+    k8s_obj.check_network()
+    return pinged, k8s_obj.checkout['c1']['network']
+
+
+def test_pods_without_ip_are_skipped():
+    pinged, network = check_network([pod('10.0.0.1', None), pod('10.0.0.1', '172.16.0.2'),
+                                     pod('10.0.0.2', None), pod(None, None)])
+    assert pinged == ['10.0.0.1', '172.16.0.2', '10.0.0.2']
+    assert network['pod_to_node']['status'] and network['pod_to_pod']['status']
+
+
+def test_host_network_pods_are_not_pod_targets():
+    pinged, _ = check_network([pod('10.0.0.1', '10.0.0.1'), pod('10.0.0.1', '172.16.0.3'),
+                               pod('10.0.0.1', '172.16.0.2')])
+    assert pinged == ['10.0.0.1', '172.16.0.2']
@@ -0,0 +1,51 @@
+import datetime
+import json
+
+from kubernetes import client
+
+from utils import normalize_object
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = json.dumps(data)
+
+
+def model_dict(data, model):
+    return client.ApiClient().deserialize(FakeResponse(data), model).to_dict()
+
+
+PENDING_POD = {"metadata": {"name": "app", "namespace": "default", "creationTimestamp": "2021-04-09T10:00:00Z",
+                            "labels": {"app.kubernetes.io/name": "app"}},
+               "spec": {"containers": [{"name": "main", "image": "nginx:1.19",
+                                        "resources": {"requests": {"cpu": "100m"}}}]},
+               "status": {"phase": "Pending"}}
+ACTIVE_JOB = {"metadata": {"name": "job", "namespace": "default"},
+              "spec": {"template": {"spec": {"containers": [{"name": "main"}]}}},
+              "status": {"active": 1, "startTime": "2021-04-09T10:00:01Z"}}
+
+
+def test_pending_pod_has_absent_fields_as_none():
+    pod = normalize_object(json.loads(json.dumps(PENDING_POD)), "V1Pod")
+    for key in ("container_statuses", "pod_ip", "host_ip", "start_time"):
+        assert pod["status"][key] is None
+    assert pod["spec"]["node_name"] is None
+    assert pod["metadata"]["labels"] == {"app.kubernetes.io/name": "app"}
+    assert pod["metadata"]["creation_timestamp"] == datetime.datetime(2021, 4, 9, 10, tzinfo=datetime.timezone.utc)
+
+
+def test_active_job_has_absent_counters_as_none():
+    job = normalize_object(json.loads(json.dumps(ACTIVE_JOB)), "V1Job")
+    assert job["status"]["succeeded"] is None
+    assert job["status"]["failed"] is None
+    assert job["status"]["active"] == 1
+
+
+def test_same_as_model_to_dict():
+    assert normalize_object(json.loads(json.dumps(PENDING_POD)), "V1Pod") == model_dict(PENDING_POD, "V1Pod")
+    assert normalize_object(json.loads(json.dumps(ACTIVE_JOB)), "V1Job") == model_dict(ACTIVE_JOB, "V1Job")
+
+
+def test_untyped_keeps_present_keys_only():
+    assert normalize_object({"podIP": "10.0.0.1", "labels": {"a.b/c": "d"}}) == \
+        {"pod_ip": "10.0.0.1", "labels": {"a.b/c": "d"}}
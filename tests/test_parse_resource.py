@@ -0,0 +1,29 @@
+import pytest
+
+from utils import parse_resource, parse_resources
+
+
+@pytest.mark.parametrize("quantity, value", [
+    ("100m", 0.1), ("1", 1), ("0.5", 0.5), ("250u", 0.00025), ("10n", 1e-08), ("-1", -1),
+    ("2k", 2000), ("100M", 100000000), ("1G", 10 ** 9), ("1T", 10 ** 12), ("1P", 10 ** 15), ("1E", 10 ** 18),
+    ("1Ki", 1024), (".5Ki", 512), ("128Mi", 128 * 1024 ** 2), ("1.5Gi", 1610612736), ("1Ti", 1024 ** 4),
+    ("1e3", 1000), ("1E3", 1000), ("5e-3", 0.005), (None, 0),
+])
+def test_quantities(quantity, value):
+    assert parse_resource(quantity) == value
+
+
+def test_whole_values_are_int():
+    assert type(parse_resource("1Gi")) is int
+    assert type(parse_resource("1500m")) is float
+
+
+@pytest.mark.parametrize("quantity", ["", "Gi", "1 Gi", "1GiB", "1x", "abc"])
+def test_invalid_quantities(quantity):
+    with pytest.raises(ValueError):
+        parse_resource(quantity)
+
+
+def test_batch_matches_single():
+    values = ["100m", "1Gi", None, "2k"]
+    assert parse_resources(values).tolist() == [float(parse_resource(v)) for v in values]
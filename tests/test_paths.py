@@ -0,0 +1,46 @@
+import jsonpath
+import pytest
+
+from paths import compile_fields, compile_path
+
+PODS = [
+    {"metadata": {"name": "a"}, "status": {"phase": "Running", "pod_ip": "10.0.0.1"}},
+    {"metadata": {"name": "b"}, "status": {"phase": "Pending", "pod_ip": None}},
+    {"metadata": {"name": "c"}, "status": {}},
+    {},
+]
+CLUSTER = {"status": {"masters": [{"name": "m1"}], "nodes": [{"name": "n1"}, {"name": "n2"}]}}
+NODES = [{"status": {"addresses": [{"type": "InternalIP", "address": "1.1.1.1"}, {"type": "Hostname"}]}}]
+
+
+@pytest.mark.parametrize("data, expr", [
+    (PODS, "$[*].status.pod_ip"),
+    (PODS, "$[*].metadata.name"),
+    (PODS[0], "$.status.phase"),
+    (NODES, "$[*].status.addresses[*].address"),
+    (CLUSTER, "$.status[masters,nodes][*]"),
+    (CLUSTER, "$.status[nodes,masters][0].name"),
+    (CLUSTER, "$.status.nodes[1].name"),
+    ({"a": {"b": 1, "c": [2]}}, "$.a[*]"),
+    ([{"a": False}, {"a": 0}, {"a": ""}], "$[*].a"),
+])
+def test_same_matches_as_jsonpath(data, expr):
+    assert compile_path(expr)(data) == jsonpath.jsonpath(data, expr)
+
+
+def test_no_match_is_empty_list():
+    assert compile_path("$[*].a")([]) == []
+    assert compile_path("$.status.phase")({}) == []
+    assert compile_path("$.status.nodes[5].name")(CLUSTER) == []
+
+
+@pytest.mark.parametrize("expr", ["status.phase", "$..name", "$.a[?(@.b)]", "$.a[(@.length-1)]", "$.a[0:2]",
+                                  "$.a[-1]"])
+def test_unsupported_paths(expr):
+    with pytest.raises(ValueError):
+        compile_path(expr)
+
+
+def test_fields():
+    fields = compile_fields("$.metadata.name", "$.status.phase")
+    assert fields(PODS) == [("a", "Running"), ("b", "Pending"), ("c", None), (None, None)]
@@ -1,22 +1,38 @@
+import datetime
+import json
+from decimal import Decimal
 import re
 import sys
+import time
 from configparser import ConfigParser
+from functools import lru_cache
+from threading import Condition
 
 import docker
+import numpy as np
+from kubernetes.client import models as k8s_models
 import paramiko
 import requests
 from requests.auth import HTTPBasicAuth
 
 from log import logger
 
+try:
+    import orjson
+
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
 ONE_MEBI = 1024 ** 2
 ONE_GIBI = 1024 ** 3
-RESOURCE_PATTERN = re.compile(r"^(\d*)(\D*)$")
+# kubernetes quantity: signed decimal number, then a decimal exponent or a binary or decimal suffix
+RESOURCE_PATTERN = re.compile(r"^([+-]?(?:\d+(?:\.\d*)?|\.\d+))(?:[eE]([+-]?\d+)|(Ki|Mi|Gi|Ti|Pi|Ei|[numkMGTPE]?))$")
 
 FACTORS = {
-    "n": 1 / 1000000000,
-    "u": 1 / 1000000,
-    "m": 1 / 1000,
+    "n": Decimal("1e-9"),
+    "u": Decimal("1e-6"),
+    "m": Decimal("1e-3"),
     "": 1,
     "k": 1000,
     "M": 1000 ** 2,
@@ -32,29 +48,134 @@ FACTORS = {
     "Ei": 1024 ** 6,
 }
 
+# raw api objects: values of these keys are maps whose keys must be kept as they are
+MAP_FIELDS = {"labels", "annotations", "data", "binaryData", "capacity", "allocatable", "limits", "requests",
+              "nodeSelector", "matchLabels", "selector", "hard", "used"}
+TIME_FIELDS = {"creationTimestamp", "deletionTimestamp", "startTime", "completionTime", "lastTransitionTime",
+               "lastHeartbeatTime", "lastProbeTime", "startedAt", "finishedAt"}
+ACRONYM_PATTERN = re.compile(r"([A-Z]+)([A-Z][a-z])")
+CAMEL_PATTERN = re.compile(r"([a-z0-9])([A-Z])")
+
 config_obj = ConfigParser()
 config_obj.read("config.ini")
 base_header = {"X-Tenant": "system-tenant", "Content-Type": "application/json", "Accept": "application/json"}
 
 
+@lru_cache(maxsize=4096)
 def parse_resource(v):
-    if v is None:
-        return 0
     """
-    Parse a Kubernetes resource value.
+    Parse a Kubernetes resource quantity, whole values are returned as int. Most pods share their
+    quantities, so parsed strings are cached.
 
     >>> parse_resource('100m')
     0.1
     >>> parse_resource('100M')
-    1000000000
+    100000000
     >>> parse_resource('2Gi')
     2147483648
     >>> parse_resource('2k')
-    2048
+    2000
+    >>> parse_resource('1.5Gi')
+    1610612736
+    >>> parse_resource('0.5')
+    0.5
+    >>> parse_resource('1e3'), parse_resource('1E'), parse_resource('.5Ki')
+    (1000, 1000000000000000000, 512)
+    >>> parse_resource('250u'), parse_resource('-1'), parse_resource(None)
+    (0.00025, -1, 0)
     """
+    if v is None:
+        return 0
     match = RESOURCE_PATTERN.match(v)
-    factor = FACTORS[match.group(2)]
-    return int(match.group(1)) * factor
+    if match is None:
+        raise ValueError(f"invalid resource quantity {v!r}")
+    number, exponent, suffix = match.groups()
+    if exponent is not None:
+        value = Decimal(number).scaleb(int(exponent))
+    else:
+        value = Decimal(number) * FACTORS[suffix]
+    return int(value) if value == value.to_integral_value() else float(value)
+
+
+def parse_resources(values):
+    """
+    Parse a sequence of quantities into a float array, None parses as 0.
+
+    >>> parse_resources(['100m', '1Gi', None]).tolist()
+    [0.1, 1073741824.0, 0.0]
+    """
+    return np.fromiter((parse_resource(v) for v in values), dtype=np.float64, count=len(values))
+
+
+@lru_cache(maxsize=None)
+def snake_case(key):
+    """
+    Attribute name the kubernetes models use for an api field.
+
+    >>> snake_case('podIP')
+    'pod_ip'
+    >>> snake_case('containerStatuses')
+    'container_statuses'
+    """
+    return CAMEL_PATTERN.sub(r"\1_\2", ACRONYM_PATTERN.sub(r"\1_\2", key)).lower()
+
+
+@lru_cache(maxsize=None)
+def model_fields(model):
+    """
+    (attribute, api key, type) of every field of a kubernetes model class name, None for other types.
+    """
+    cls = getattr(k8s_models, model, None)
+    if cls is None or not hasattr(cls, "openapi_types"):
+        return None
+    return tuple((attr, cls.attribute_map[attr], type_name) for attr, type_name in cls.openapi_types.items())
+
+
+def normalize_typed(value, type_name):
+    if value is None:
+        return None
+    if type_name.startswith("list["):
+        return [normalize_typed(v, type_name[5:-1]) for v in value]
+    if type_name.startswith("dict("):
+        value_type = type_name[5:-1].split(", ", 1)[1]
+        return {k: normalize_typed(v, value_type) for k, v in value.items()}
+    if type_name == "datetime" and isinstance(value, str):
+        return datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if type_name == "date" and isinstance(value, str):
+        return datetime.date.fromisoformat(value)
+    fields = model_fields(type_name)
+    if fields is None or not isinstance(value, dict):
+        return value
+    return {attr: normalize_typed(value.get(key), field_type) for attr, key, field_type in fields}
+
+
+def normalize_object(obj, model=None):
+    """
+    Turn a decoded api object into the same plain dict ``to_dict()`` returns for its model: snake_case
+    keys and datetime timestamps, without building the model classes.
+
+    :param model: kubernetes model class name of obj such as V1Pod, the keys then come from the model and
+        absent fields are None like in ``to_dict()``, without it only the keys present are converted
+
+    >>> pod = normalize_object({"metadata": {"name": "a"}, "status": {"phase": "Pending"}}, "V1Pod")
+    >>> pod["status"]["pod_ip"], pod["status"]["container_statuses"], pod["metadata"]["name"]
+    (None, None, 'a')
+    """
+    if model is not None:
+        return normalize_typed(obj, model)
+    if isinstance(obj, dict):
+        result = dict()
+        for key, value in obj.items():
+            if key in MAP_FIELDS and isinstance(value, dict):
+                result[snake_case(key)] = value
+            elif key in TIME_FIELDS and isinstance(value, str):
+                result[snake_case(key)] = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+            else:
+                result[snake_case(key)] = normalize_object(value)
+        return result
+    if isinstance(obj, list):
+        return [normalize_object(x) for x in obj]
+    return obj
 
 
 def base_request(method, url, data=None, headers=None):
@@ -85,38 +206,154 @@ def base_request(method, url, data=None, headers=None):
     return True, ret.json()
 
 
+class SSHSessionPool(object):
+    """
+    Authenticated ssh transports shared by every check of a run and keyed by (host, port, user).
+    Each command opens a new channel on the pooled transport instead of a new connection.
+    """
+
+    def __init__(self, max_sessions: int = None, idle_timeout: int = None):
+        self.max_sessions = max_sessions or config_obj.getint('ssh', 'max_sessions', fallback=100)
+        self.idle_timeout = idle_timeout or config_obj.getint('ssh', 'idle_timeout', fallback=300)
+        # key -> {'transport': transport, 'users': number of clients holding it, 'last_used': monotonic time,
+        #         'checking': whether a health check of the transport is running}
+        self.__sessions = dict()
+        self.__cond = Condition()
+
+    @staticmethod
+    def healthy(transport) -> bool:
+        if not transport.is_active() or not transport.is_authenticated():
+            return False
+        # the same keepalive round trip openssh sends for ServerAliveInterval
+        try:
+            transport.global_request('keepalive@openssh.com', wait=True)
+        except Exception:
+            return False
+        return transport.is_active()
+
+    def __drop(self, key):
+        session = self.__sessions.pop(key)
+        if session['transport'] is not None:
+            session['transport'].close()
+        logger.info(f"ssh session pool close {key[0]}")
+
+    def __make_room(self):
+        now = time.monotonic()
+        for key in [k for k, v in self.__sessions.items() if v['users'] == 0 and
+                    now - v['last_used'] > self.idle_timeout]:
+            self.__drop(key)
+        while len(self.__sessions) >= self.max_sessions:
+            idle = [k for k, v in self.__sessions.items() if v['users'] == 0]
+            if idle:
+                self.__drop(min(idle, key=lambda k: self.__sessions[k]['last_used']))
+            else:
+                self.__cond.wait()
+
+    def acquire(self, key, connect):
+        """
+        Transport of key, ``connect`` is called to open a new one when none is pooled or the pooled one
+        failed its health check.
+        """
+        while True:
+            with self.__cond:
+                session = self.__sessions.get(key)
+                while session is not None and (session['transport'] is None or session['checking']):
+                    # another check is doing the handshake or the health check with this host
+                    self.__cond.wait()
+                    session = self.__sessions.get(key)
+                if session is None:
+                    self.__make_room()
+                    session = {'transport': None, 'users': 1, 'last_used': time.monotonic(), 'checking': False}
+                    self.__sessions[key] = session
+                    break
+                session['checking'] = True
+                session['users'] += 1
+                transport = session['transport']
+            # the keepalive round trip runs without the pool lock, a slow host only delays its own checks
+            alive = self.healthy(transport)
+            with self.__cond:
+                session['checking'] = False
+                self.__cond.notify_all()
+                if alive:
+                    session['last_used'] = time.monotonic()
+                    return transport
+                session['users'] -= 1
+                if self.__sessions.get(key) is session:
+                    self.__sessions.pop(key)
+            transport.close()
+            logger.info(f"ssh session pool close {key[0]}")
+        try:
+            transport = connect()
+        except BaseException:
+            with self.__cond:
+                self.__sessions.pop(key, None)
+                self.__cond.notify_all()
+            raise
+        with self.__cond:
+            session['transport'] = transport
+            self.__cond.notify_all()
+        return transport
+
+    def release(self, key, transport):
+        with self.__cond:
+            session = self.__sessions.get(key)
+            if session and session['transport'] is transport:
+                session['users'] -= 1
+                session['last_used'] = time.monotonic()
+                self.__cond.notify_all()
+
+    def close_all(self):
+        with self.__cond:
+            for key in list(self.__sessions.keys()):
+                self.__drop(key)
+            self.__cond.notify_all()
+
+
 class RemoteClientCompass(object):
-    def __init__(self, host: str, user: str, ssh_port: int = 22, pwd: str = None, ssh_key: str = None):
+    def __init__(self, host: str, user: str, ssh_port: int = 22, pwd: str = None, ssh_key: str = None,
+                 pool: SSHSessionPool = None):
         self.host = host
         self.ssh_port = ssh_port
         self.user = user
         self.pwd = pwd
         self.ssh_key = ssh_key
+        self.pool = pool
         self.__transport = None
 
+    def __open_transport(self):
+        transport = paramiko.Transport((self.host, self.ssh_port))
+        try:
+            if self.ssh_key == "ssh-global":
+                private_key = paramiko.RSAKey.from_private_key_file('./tmp/private.pem')
+                transport.connect(username=self.user, pkey=private_key)
+            elif self.pwd:
+                transport.connect(username=self.user, password=self.pwd)
+            else:
+                logger.error(f'{self.host} has no auth')
+                raise
+            logger.info(f"login to {self.host}")
+
+        except paramiko.AuthenticationException as ssh_err:
+            logger.error(f"connect to {self.host}, get some err: {ssh_err}")
+            raise ssh_err
+        return transport
+
     @logger.catch
     def connect(self):
         if self.__transport is None:
-            transport = paramiko.Transport((self.host, self.ssh_port))
-            try:
-                if self.ssh_key == "ssh-global":
-                    private_key = paramiko.RSAKey.from_private_key_file('./tmp/private.pem')
-                    transport.connect(username=self.user, pkey=private_key)
-                elif self.pwd:
-                    transport.connect(username=self.user, password=self.pwd)
-                else:
-                    logger.error(f'{self.host} has no auth')
-                    raise
-                logger.info(f"login to {self.host}")
-
-            except paramiko.AuthenticationException as ssh_err:
-                logger.error(f"connect to {self.host}, get some err: {ssh_err}")
-                raise ssh_err
-            self.__transport = transport
+            if self.pool is not None:
+                self.__transport = self.pool.acquire((self.host, self.ssh_port, self.user), self.__open_transport)
+            else:
+                self.__transport = self.__open_transport()
 
     @logger.catch
-    def cmd(self, commands):
+    def cmd(self, commands, label=None):
+        """
+        :param label: logged at debug level in place of commands, for generated scripts
+        """
         self.connect()
+        log = logger.info if label is None else logger.debug
+        shown = commands if label is None else label
         ssh = paramiko.SSHClient()
         ssh._transport = self.__transport
         stdin, stdout, stderr = ssh.exec_command(commands)
@@ -124,11 +361,11 @@ class RemoteClientCompass(object):
         if status == 0:
             response = stdout.readlines()
             for line in response:
-                logger.info(f'INPUT: {commands} | OUTPUT: {line}')
+                log(f'INPUT: {shown} | OUTPUT: {line}')
             return response
         else:
             error_msg = stderr.read().decode()
-            logger.error("command {} failed  | {}".format(commands, error_msg))
+            logger.error("command {} failed  | {}".format(shown, error_msg))
             return error_msg
 
     @logger.catch
@@ -138,8 +375,14 @@ class RemoteClientCompass(object):
 
     @logger.catch
     def close(self):
-        self.__transport.close()
-        logger.info(f"logout from {self.host}")
+        if self.__transport is None:
+            return
+        if self.pool is not None:
+            self.pool.release((self.host, self.ssh_port, self.user), self.__transport)
+        else:
+            self.__transport.close()
+            logger.info(f"logout from {self.host}")
+        self.__transport = None
 
 
 def load_images_to_cargo(user: str, pwd: str, registry: str, images_tar):
@@ -159,30 +402,67 @@ def load_images_to_cargo(user: str, pwd: str, registry: str, images_tar):
 
 
 def merge_node(dump, cid):
-    node_list = dump[cid]['context']['node']['result']
-    node_metric_list = dump[cid]['context']['metric']['nodes']
-    node_info = dump[cid]['node_info']
+    """
+    Join the node list and the node metrics into the ssh probed node info, keyed by node ip.
+    The report is not modified, nodes that were not probed are left out. A node whose last probe failed
+    gets the error as probe_error, its other probe results are from an earlier run.
+    """
+    context = dump[cid]['context']
+    node_list = context.get('node', {}).get('result') or []
+    node_metrics = {m.node: m for m in context.get('metric', {}).get('nodes') or []}
+    node_info = {ip: dict(info) for ip, info in dump[cid].get('node_info', {}).items()}
+    for ip, error in dump[cid].get('node_failures', {}).items():
+        node_info.setdefault(ip, dict())['probe_error'] = error
     for i in node_list:
-        for m in node_metric_list:
-            if i['Hostname'] == m.node:
-                i['cpu_usage'] = m.cpu
-                i['mem_usage'] = m.memory
-        node_info[i['InternalIP']].update(i)
+        if i.get('InternalIP') not in node_info:
+            continue
+        node = node_info[i['InternalIP']]
+        node.update(i)
+        m = node_metrics.get(i.get('Hostname'))
+        if m is not None:
+            node['cpu_usage'] = m.cpu
+            node['mem_usage'] = m.memory
     return node_info
 
 
 def merge_pod(dump, cid):
-    pods = dump[cid]['context']['pod']['result']
-    pod_metric_list = dump[cid]['context']['metric']['pods']
-    for i in pods:
-        for m in pod_metric_list:
-            if i['name'] == m.pod and i['ns'] == m.ns:
-                i['cpu'] = m.cpu
-                i['cpu_requests'] = m.cpu_requests
-                i['cpu_limits'] = m.cpu_limits
-                #i['start_time'] = f'{i["start_time"]:%Y-%m-%d %H:%M:%S }'
-                i['memory'] = m.memory
-                i['memory_requests'] = m.memory_requests
-                i['memory_limits'] = m.memory_limits
+    """
+    Join the pod list and the pod metrics on (namespace, name), the report is not modified.
+    """
+    context = dump[cid]['context']
+    pod_metrics = {(m.ns, m.pod): m for m in context.get('metric', {}).get('pods') or []}
+    pods = list()
+    for i in context.get('pod', {}).get('result') or []:
+        pod = dict(i)
+        m = pod_metrics.get((i.get('ns'), i.get('name')))
+        if m is not None:
+            pod['cpu'] = m.cpu
+            pod['cpu_requests'] = m.cpu_requests
+            pod['cpu_limits'] = m.cpu_limits
+            pod['memory'] = m.memory
+            pod['memory_requests'] = m.memory_requests
+            pod['memory_limits'] = m.memory_limits
+        pods.append(pod)
     return pods
 
+
+def merge_views(checkout):
+    """
+    Precompute the merged node and pod views and the resource rollups of every cluster once, before the
+    report is stored. A cluster whose views can not be built gets the error recorded and is stored without them.
+    """
+    for cid, data in checkout.items():
+        if not isinstance(data, dict) or 'context' not in data:
+            continue
+        try:
+            data['node_view'] = merge_node(checkout, cid)
+            data['pod_view'] = merge_pod(checkout, cid)
+            data['resource_rollups'] = data['context'].get('metric', {}).get('rollups', {})
+        except Exception as err:
+            logger.exception(f"merge the views of {cid} failed: {err}")
+            data.pop('node_view', None)
+            data.pop('pod_view', None)
+            data.pop('resource_rollups', None)
+            data['error'] = '; '.join(filter(None, [data.get('error'), f"merge views failed: {err}"]))
+
+